@@ -0,0 +1,407 @@
+"""Offline benchmarks for the render pipeline.
+
+Synthesizes fixtures with ffmpeg lavfi, serves them from a local HTTP stub
+and times each pipeline stage separately. Nothing touches the network:
+stages that need Whisper or rembg weights are skipped unless the weights
+are already in their download caches (run the service once, or call
+whisper.load_model / rembg.new_session, to fetch them beforehand).
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --repeat 3 --output bench.json
+    python -m benchmarks.run_benchmarks --stages encode,render,concat
+
+Results are written as JSON so runs can be compared across commits.
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STAGES = [
+    "download", "probe", "whisper_load", "transcription", "encode", "render",
+    "concat", "background_removal", "composite", "upload"
+]
+
+
+def ffmpeg(*args):
+    subprocess.run(["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *args], check=True)
+
+
+def make_fixtures(fixture_dir: str, audio_seconds: int) -> dict:
+    """Create the image, narration, prefix clip and avatar clip used by every stage"""
+    fixtures = {
+        "image": os.path.join(fixture_dir, "background.png"),
+        "audio": os.path.join(fixture_dir, "narration.mp3"),
+        "prefix": os.path.join(fixture_dir, "prefix.mp4"),
+        "avatar": os.path.join(fixture_dir, "avatar.mp4")
+    }
+
+    ffmpeg("-f", "lavfi", "-i", "testsrc2=size=1920x1080", "-frames:v", "1", fixtures["image"])
+
+    # Prefer synthetic speech so Whisper has words to find; fall back to a
+    # tone gated on and off like speech when ffmpeg lacks libflite
+    text = "This is a benchmark narration for the video generation pipeline. " * max(1, audio_seconds // 4)
+    try:
+        ffmpeg(
+            "-f", "lavfi", "-i", f"flite=text='{text}'",
+            "-t", str(audio_seconds), "-ar", "44100", "-ac", "2", fixtures["audio"]
+        )
+    except subprocess.CalledProcessError:
+        ffmpeg(
+            "-f", "lavfi", "-i", f"sine=frequency=220:duration={audio_seconds}",
+            "-af", "volume='if(lt(mod(t,3),2),1,0)':eval=frame",
+            "-ar", "44100", "-ac", "2", fixtures["audio"]
+        )
+
+    # A prefix deliberately outside the output profile so normalization runs
+    ffmpeg(
+        "-f", "lavfi", "-i", "testsrc2=size=1920x1080:rate=30:duration=5",
+        "-f", "lavfi", "-i", "sine=frequency=440:duration=5:sample_rate=48000",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", fixtures["prefix"]
+    )
+
+    # A presenter-like shape moving on a plain white background
+    ffmpeg(
+        "-f", "lavfi", "-i", "color=white:size=640x360:rate=25:duration=2",
+        "-f", "lavfi", "-i", "testsrc2=size=160x240:rate=25:duration=2",
+        "-f", "lavfi", "-i", "sine=frequency=330:duration=2",
+        "-filter_complex", "[0:v][1:v]overlay=x='240+20*sin(t*3)':y=80[v]",
+        "-map", "[v]", "-map", "2:a", "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac",
+        "-shortest", fixtures["avatar"]
+    )
+    return fixtures
+
+
+def start_http_stub(directory: str) -> tuple[http.server.ThreadingHTTPServer, str]:
+    """Serve fixture files on an ephemeral localhost port"""
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def start_fake_drive() -> tuple[http.server.ThreadingHTTPServer, str]:
+    """Serve the subset of the Drive v3 API that uploads use, discarding the bytes.
+
+    Handles resumable upload sessions (answering 308 until the last chunk)
+    and permission creation, so the real Drive client and chunking code run.
+    """
+    received = {}
+    lock = threading.Lock()
+
+    class FakeDriveHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status: int, body: dict, headers: dict | None = None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_POST(self):
+            self._read_body()
+            if self.path.startswith("/upload/"):
+                # Start a resumable session
+                session_id = os.urandom(8).hex()
+                with lock:
+                    received[session_id] = 0
+                host, port = self.server.server_address
+                self._json(200, {}, {"Location": f"http://{host}:{port}/session/{session_id}"})
+            else:
+                self._json(200, {"id": "permission"})
+
+        def do_PUT(self):
+            session_id = self.path.rsplit("/", 1)[-1]
+            size = len(self._read_body())
+            total = int(self.headers.get("Content-Range", "*/0").rsplit("/", 1)[-1])
+            with lock:
+                received[session_id] += size
+                done = received[session_id] >= total
+                last_byte = received[session_id] - 1
+            if done:
+                self._json(200, {"id": session_id})
+            else:
+                self.send_response(308)
+                self.send_header("Range", f"bytes=0-{last_byte}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeDriveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def whisper_weights(model_size: str) -> str | None:
+    """Return where Whisper keeps the weights for model_size, or None if they aren't downloaded"""
+    import whisper
+    if os.path.isfile(model_size):
+        return model_size
+    if model_size not in whisper._MODELS:
+        return None
+    cache_dir = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "whisper")
+    path = os.path.join(cache_dir, os.path.basename(whisper._MODELS[model_size]))
+    return path if os.path.isfile(path) else None
+
+
+def rembg_weights(model: str) -> str | None:
+    """Return where rembg keeps the weights for model, or None if they aren't downloaded"""
+    home = os.getenv("U2NET_HOME", os.path.join(os.getenv("XDG_DATA_HOME", os.path.expanduser("~")), ".u2net"))
+    path = os.path.join(home, f"{model}.onnx")
+    return path if os.path.isfile(path) else None
+
+
+def time_stage(func, repeat: int) -> dict:
+    """Run func repeat times and summarize wall times; func returns optional metadata"""
+    runs = []
+    meta = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        meta = func()
+        runs.append(time.perf_counter() - start)
+    return {
+        "runs": [round(r, 4) for r in runs],
+        "min": round(min(runs), 4),
+        "median": round(statistics.median(runs), 4),
+        "meta": meta
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def run(stages: list[str], repeat: int, audio_seconds: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    fixture_dir = os.path.join(work_dir, "fixtures")
+    scratch_dir = os.path.join(work_dir, "scratch")
+    os.makedirs(fixture_dir)
+    os.makedirs(scratch_dir)
+
+    # Keep caches and outputs inside the benchmark directory and off by
+    # default so every run measures the uncached path
+    os.environ.setdefault("ASSET_CACHE_ENABLED", "false")
+    os.environ.setdefault("ASSET_CACHE_DIR", os.path.join(work_dir, "asset_cache"))
+    os.environ.setdefault("PREFIX_CACHE_DIR", os.path.join(work_dir, "prefix_cache"))
+    os.environ.setdefault("TRANSCRIPT_CACHE_DIR", os.path.join(work_dir, "transcript_cache"))
+    os.environ.setdefault("STORAGE_LOCAL_DIR", os.path.join(work_dir, "storage"))
+
+    # Uploads go through the real Drive client to a local fake Drive server
+    drive_server, drive_endpoint = start_fake_drive()
+    os.environ["DRIVE_API_ENDPOINT"] = drive_endpoint
+    os.environ["DRIVE_ANONYMOUS"] = "true"
+
+    import config
+    from utils.file_handler import download_file
+    from services import video
+    from services.storage import DriveStorage
+
+    fixtures = make_fixtures(fixture_dir, audio_seconds)
+    server, base_url = start_http_stub(fixture_dir)
+    results = {}
+    segments = []
+    rendered = os.path.join(scratch_dir, "rendered.mp4")
+
+    def scratch(name: str) -> str:
+        return os.path.join(scratch_dir, name)
+
+    try:
+        if "download" in stages:
+            def download():
+                path, _ = download_file(f"{base_url}/prefix.mp4", scratch("download"), use_cache=False)
+                return {"bytes": os.path.getsize(path)}
+            results["download"] = time_stage(download, repeat)
+
+        if "probe" in stages:
+            results["probe"] = time_stage(lambda: video.probe_video(fixtures["prefix"]) and None, repeat)
+
+        if ("whisper_load" in stages or "transcription" in stages) and not whisper_weights(config.WHISPER_MODEL_SIZE):
+            skipped = {"skipped": f"Whisper {config.WHISPER_MODEL_SIZE} weights are not downloaded"}
+            for stage in ("whisper_load", "transcription"):
+                if stage in stages:
+                    results[stage] = skipped
+        elif "whisper_load" in stages or "transcription" in stages:
+            from services import whisper_models
+            model_size = config.WHISPER_MODEL_SIZE
+
+            def whisper_load():
+                whisper_models._models.pop(model_size, None)
+                whisper_models.get_whisper_model(model_size)
+                return {"model": model_size, **whisper_models.get_model_status()["loaded"][model_size]}
+            results["whisper_load"] = time_stage(whisper_load, 1)
+
+            def transcription():
+                # Call the model directly so the transcript cache can't short-circuit it
+                model = whisper_models.get_whisper_model(model_size)
+                result = model.transcribe(fixtures["audio"], verbose=False)
+                segments[:] = result["segments"]
+                return {"segments": len(segments)}
+            if "transcription" in stages:
+                results["transcription"] = time_stage(transcription, repeat)
+
+        segments = segments or [{"start": 0.0, "end": 2.0, "text": "benchmark"}]
+        srt_path = scratch("subtitles.srt")
+        video.write_srt(segments, srt_path)
+
+        # Seed the transcript cache so create_video renders without running Whisper
+        from services.transcript_cache import audio_hash, store_transcript
+        store_transcript(audio_hash(fixtures["audio"]), config.WHISPER_MODEL_SIZE, config.WHISPER_LANGUAGE, segments)
+
+        if "encode" in stages:
+            # Plain image + audio encode, without subtitles or watermark
+            def encode():
+                ffmpeg(
+                    "-loop", "1", "-i", fixtures["image"], "-i", fixtures["audio"], "-shortest",
+                    "-vf", f"scale={config.OUTPUT_WIDTH}:{config.OUTPUT_HEIGHT}",
+                    "-c:v", "libx264", "-tune", "stillimage", "-pix_fmt", "yuv420p",
+                    "-c:a", "aac", scratch("encode_only.mp4")
+                )
+            results["encode"] = time_stage(encode, repeat)
+
+        if "render" in stages or "concat" in stages or "upload" in stages:
+            # The production render path, so still-image mode and segment-parallel
+            # settings apply exactly as they do for a request
+            def render():
+                video.create_video(fixtures["image"], fixtures["audio"], rendered, workspace=scratch_dir)
+                return {"bytes": os.path.getsize(rendered)}
+            results["render"] = time_stage(render, repeat if "render" in stages else 1)
+
+        if "encode" in results and "render" in results:
+            # The render has no separate burn step; estimate it as the difference
+            results["subtitle_burn_estimate"] = {
+                "median": round(results["render"]["median"] - results["encode"]["median"], 4)
+            }
+
+        if "concat" in stages:
+            def concat():
+                # Clear normalized prefixes so each run includes normalization
+                shutil.rmtree(config.PREFIX_CACHE_DIR, ignore_errors=True)
+                os.makedirs(config.PREFIX_CACHE_DIR, exist_ok=True)
+                video.concat_videos(fixtures["prefix"], rendered, scratch("concat.mp4"))
+            results["concat"] = time_stage(concat, repeat)
+
+            # A second concat with the normalized prefix cached is the steady state
+            results["concat_cached"] = time_stage(
+                lambda: video.concat_videos(fixtures["prefix"], rendered, scratch("concat.mp4")), repeat
+            )
+
+        if "background_removal" in stages:
+            try:
+                from services.background_removal import remove_background
+            except ImportError as e:
+                results["background_removal"] = {"skipped": str(e)}
+            else:
+                def background_removal(mode):
+                    return remove_background(fixtures["avatar"], scratch("transparent.mp4"), mode)
+                if rembg_weights(config.REMBG_MODEL):
+                    results["background_removal"] = time_stage(lambda: background_removal("ml"), repeat)
+                else:
+                    results["background_removal"] = {"skipped": f"rembg {config.REMBG_MODEL} weights are not downloaded"}
+                results["background_removal_colorkey"] = time_stage(
+                    lambda: background_removal("colorkey"), repeat
+                )
+
+        if "composite" in stages:
+            try:
+                from services.compositing import render_avatar_video
+            except ImportError as e:
+                results["composite"] = {"skipped": str(e)}
+            else:
+                # Single-pass avatar compositing with the cheap color key, so
+                # the number reflects blending and encoding rather than rembg
+                def composite():
+                    return render_avatar_video(
+                        fixtures["image"], fixtures["avatar"], fixtures["audio"], srt_path,
+                        scratch("avatar_final.mp4"), "colorkey"
+                    )
+                results["composite"] = time_stage(composite, repeat)
+
+        if "upload" in stages:
+            # Chunked resumable upload over HTTP, against the fake Drive server
+            sink = DriveStorage()
+
+            def upload():
+                result = sink.upload(rendered)
+                return result["upload_stats"]
+            results["upload"] = time_stage(upload, repeat)
+
+    finally:
+        server.shutdown()
+        drive_server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count()
+        },
+        "settings": {
+            "repeat": repeat,
+            "audio_seconds": audio_seconds,
+            "still_image_mode": config.STILL_IMAGE_MODE,
+            "segment_parallel_workers": config.SEGMENT_PARALLEL_WORKERS,
+            "segment_parallel_min_seconds": config.SEGMENT_PARALLEL_MIN_SECONDS,
+            "whisper_model": config.WHISPER_MODEL_SIZE,
+            "drive_upload_chunk_size": config.DRIVE_UPLOAD_CHUNK_SIZE
+        },
+        "stages": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the render pipeline offline")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"comma-separated subset of: {', '.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage")
+    parser.add_argument("--audio-seconds", type=int, default=30, help="length of the synthetic narration")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    results = run(stages, args.repeat, args.audio_seconds)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,19 @@ load_dotenv()
 # Application configuration
 TEMP_DIR = "video_temp"
 MAX_FILE_SIZE_MB = 100
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 60
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 16))
 SUPPORTED_IMAGE_FORMATS = ['jpg', 'jpeg', 'png', 'bmp', 'gif', 'webp']
 SUPPORTED_AUDIO_FORMATS = ['mp3', 'wav', 'aac', 'm4a', 'ogg']
 GOOGLE_DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive.file']
+# Resumable upload chunks must be a multiple of 256KB
+DRIVE_UPLOAD_CHUNK_SIZE = int(os.getenv("DRIVE_UPLOAD_CHUNK_MB", 8)) * 1024 * 1024
+DRIVE_UPLOAD_RETRIES = int(os.getenv("DRIVE_UPLOAD_RETRIES", 5))
+DRIVE_HTTP_TIMEOUT_SECONDS = int(os.getenv("DRIVE_HTTP_TIMEOUT_SECONDS", 120))
+# Point at a local fake Drive server for testing, e.g. http://127.0.0.1:9000/
+DRIVE_API_ENDPOINT = os.getenv("DRIVE_API_ENDPOINT")
+DRIVE_ANONYMOUS = os.getenv("DRIVE_ANONYMOUS", "false").lower() == "true"
 MIME_TO_FORMAT = {
     'image/jpeg': 'jpg',
     'image/png': 'png',
@@ -24,5 +34,111 @@ MIME_TO_FORMAT = {
     'audio/ogg': 'ogg'
 }
 
+# Output storage configuration: "drive", "local" or "s3"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "drive").lower()
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", "output_files")
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8001").rstrip("/")
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. a local MinIO at http://127.0.0.1:9000
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_KEY_PREFIX = os.getenv("S3_KEY_PREFIX", "videos/")
+S3_PUBLIC_BASE_URL = os.getenv("S3_PUBLIC_BASE_URL")
+S3_PRESIGN_EXPIRY_SECONDS = int(os.getenv("S3_PRESIGN_EXPIRY_SECONDS", 7 * 24 * 3600))
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv("S3_MULTIPART_CHUNK_MB", 16)) * 1024 * 1024
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", 8))
+# Stream fragmented MP4 to storage while ffmpeg is still encoding
+STREAMING_UPLOAD = os.getenv("STREAMING_UPLOAD", "false").lower() == "true"
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Output profile for rendered videos; prefix videos are normalized to it
+# so they can be joined with a stream copy
+OUTPUT_WIDTH = 1280
+OUTPUT_HEIGHT = 720
+OUTPUT_FPS = 25
+OUTPUT_VIDEO_TIMESCALE = 12800
+OUTPUT_AUDIO_SAMPLE_RATE = 44100
+OUTPUT_AUDIO_CHANNELS = 2
+# Still-image mode encodes only frames where the caption changes instead of
+# OUTPUT_FPS identical frames; the sample rate bounds caption timing error
+STILL_IMAGE_MODE = os.getenv("STILL_IMAGE_MODE", "false").lower() == "true"
+STILL_IMAGE_SAMPLE_FPS = int(os.getenv("STILL_IMAGE_SAMPLE_FPS", 10))
+STILL_IMAGE_GOP_SECONDS = int(os.getenv("STILL_IMAGE_GOP_SECONDS", 10))
+# Split long narrations into this many chunks encoded in parallel (0 disables)
+SEGMENT_PARALLEL_WORKERS = int(os.getenv("SEGMENT_PARALLEL_WORKERS", 0))
+SEGMENT_PARALLEL_MIN_SECONDS = int(os.getenv("SEGMENT_PARALLEL_MIN_SECONDS", 180))
+PREFIX_CACHE_DIR = os.getenv("PREFIX_CACHE_DIR", "prefix_cache")
+PREFIX_CACHE_MAX_BYTES = int(os.getenv("PREFIX_CACHE_MAX_MB", 2048)) * 1024 * 1024
+
+# Whisper configuration
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "tiny")
+WHISPER_PRELOAD_MODELS = [
+    size.strip() for size in os.getenv("WHISPER_PRELOAD_MODELS", WHISPER_MODEL_SIZE).split(",") if size.strip()
+]
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE") or None
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", "transcript_cache")
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPT_CACHE_MAX_MB", 256)) * 1024 * 1024
+
+# Downloaded asset cache configuration
+ASSET_CACHE_ENABLED = os.getenv("ASSET_CACHE_ENABLED", "true").lower() == "true"
+ASSET_CACHE_DIR = os.getenv("ASSET_CACHE_DIR", "asset_cache")
+ASSET_CACHE_MAX_BYTES = int(os.getenv("ASSET_CACHE_MAX_MB", 2048)) * 1024 * 1024
+
+# Render worker pool configuration
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", 100))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", 3600))
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", 500))
+# Batch items queue against their own limit, so a campaign can't starve single requests
+MAX_QUEUED_BATCH_JOBS = int(os.getenv("MAX_QUEUED_BATCH_JOBS", 1000))
+# Batch assets are downloaded at most this many items ahead of the renders
+BATCH_DOWNLOAD_AHEAD = int(os.getenv("BATCH_DOWNLOAD_AHEAD", RENDER_WORKERS * 2))
+
+# HeyGen configuration; point HEYGEN_BASE_URL at a local mock server for testing
+HEYGEN_API_KEY = os.getenv("HEYGEN_API_KEY")
+HEYGEN_BASE_URL = os.getenv("HEYGEN_BASE_URL", "https://api.heygen.com").rstrip("/")
+HEYGEN_HTTP_TIMEOUT_SECONDS = int(os.getenv("HEYGEN_HTTP_TIMEOUT_SECONDS", 30))
+HEYGEN_MAX_CONNECTIONS = int(os.getenv("HEYGEN_MAX_CONNECTIONS", 20))
+# Status polls start at the initial interval and double up to the maximum
+HEYGEN_POLL_INITIAL_SECONDS = float(os.getenv("HEYGEN_POLL_INITIAL_SECONDS", 5))
+HEYGEN_POLL_MAX_SECONDS = float(os.getenv("HEYGEN_POLL_MAX_SECONDS", 30))
+HEYGEN_POLL_TIMEOUT_SECONDS = int(os.getenv("HEYGEN_POLL_TIMEOUT_SECONDS", 2500))
+# Public URL of /heygen/webhook; when set HeyGen calls it on completion and
+# waiting requests wake up without waiting for their next poll
+HEYGEN_CALLBACK_URL = os.getenv("HEYGEN_CALLBACK_URL")
+HEYGEN_WEBHOOK_SECRET = os.getenv("HEYGEN_WEBHOOK_SECRET")
+
+# Avatar background removal configuration
+# "colorkey" keys out a plain background, "ml" segments with rembg, and
+# "auto" samples frames and uses rembg only when the color key looks poor
+BACKGROUND_REMOVAL_MODE = os.getenv("BACKGROUND_REMOVAL_MODE", "auto")
+BACKGROUND_KEY_COLOR = os.getenv("BACKGROUND_KEY_COLOR", "ffffff")
+BACKGROUND_KEY_SIMILARITY = float(os.getenv("BACKGROUND_KEY_SIMILARITY", 0.1))
+BACKGROUND_KEY_BLEND = float(os.getenv("BACKGROUND_KEY_BLEND", 0.5))
+BACKGROUND_AUTO_SAMPLES = int(os.getenv("BACKGROUND_AUTO_SAMPLES", 5))
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+# Avatar subtitles: "script" times the known input text against the audio,
+# "whisper" transcribes it
+SUBTITLE_ALIGNMENT_MODE = os.getenv("SUBTITLE_ALIGNMENT_MODE", "script")
+SUBTITLE_MAX_WORDS = int(os.getenv("SUBTITLE_MAX_WORDS", 8))
+# Worker processes running rembg in parallel, each with its own model (0 runs it in-process)
+REMBG_WORKERS = int(os.getenv("REMBG_WORKERS", 0))
+REMBG_BATCH_SIZE = int(os.getenv("REMBG_BATCH_SIZE", 4))
+# Reuse the last mask for frames that barely differ from the last segmented
+# one: the threshold is the fraction of pixels allowed to change, and a
+# fresh mask is forced at least every MASK_REUSE_MAX_FRAMES frames
+MASK_REUSE_ENABLED = os.getenv("MASK_REUSE_ENABLED", "false").lower() == "true"
+MASK_REUSE_THRESHOLD = float(os.getenv("MASK_REUSE_THRESHOLD", 0.01))
+MASK_REUSE_MAX_FRAMES = int(os.getenv("MASK_REUSE_MAX_FRAMES", 10))
+
+# Profiling: always on with PROFILE_RENDERS, or per request with an X-Profile header
+PROFILE_RENDERS = os.getenv("PROFILE_RENDERS", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_TOP_FUNCTIONS = 30
+# Only the newest profiles are kept; older ones are deleted as new ones are saved
+PROFILE_MAX_COUNT = int(os.getenv("PROFILE_MAX_COUNT", 200))
+
 # Create temp directories
-os.makedirs(TEMP_DIR, exist_ok=True)
\ No newline at end of file
+os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(PREFIX_CACHE_DIR, exist_ok=True)
+os.makedirs(STORAGE_LOCAL_DIR, exist_ok=True)
+os.makedirs(PROFILE_DIR, exist_ok=True)
\ No newline at end of file
@@ -1,10 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import uvicorn
 import os
 
 from routes.generate_video import router as generate_video_router
 from routes.base64 import router as hex_to_base64_router
-# from routes.generate_avatar_video import router as generate_avatar_video_router
+from routes.jobs import router as jobs_router
+from routes.files import router as files_router
+from routes.profiles import router as profiles_router
+from services.whisper_models import preload_models, get_model_status
+from services.transcript_cache import get_transcript_cache_stats, clear_transcript_cache
+from services.google_drive import get_upload_stats
+from utils.asset_cache import get_cache_stats
+from routes.generate_avatar_video import router as generate_avatar_video_router
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -16,7 +24,16 @@ app = FastAPI(
 # Import routes
 app.include_router(generate_video_router)
 app.include_router(hex_to_base64_router)
-# app.include_router(generate_avatar_video_router)
+app.include_router(jobs_router)
+app.include_router(files_router)
+app.include_router(profiles_router)
+app.include_router(generate_avatar_video_router)
+
+
+@app.on_event("startup")
+def load_whisper_models():
+    # Load Whisper weights once per process instead of once per request
+    preload_models()
 
 
 @app.get("/")
@@ -27,6 +44,30 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/whisper-models")
+def whisper_models_status():
+    return get_model_status()
+
+@app.get("/transcript-cache")
+def transcript_cache_status():
+    return get_transcript_cache_stats()
+
+@app.delete("/transcript-cache")
+def transcript_cache_clear():
+    return {"removed": clear_transcript_cache()}
+
+@app.get("/asset-cache")
+def asset_cache_status():
+    return get_cache_stats()
+
+@app.get("/drive-uploads")
+def drive_upload_status():
+    return get_upload_stats()
+
 @app.get("/version")
 def get_version():
     return {"version": "1.0.0"}
@@ -0,0 +1,25 @@
+from fastapi import HTTPException, APIRouter
+from fastapi.responses import FileResponse
+from services.storage import get_storage, LocalStorage
+
+router = APIRouter()
+
+
+@router.get("/files/{file_id}")
+def get_file(file_id: str, download: bool = False):
+    """Serve a result stored by the local storage backend (supports Range requests)"""
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="Local file serving is not enabled")
+
+    path = storage.resolve(file_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {file_id}")
+
+    # FileResponse answers Range requests with 206 partial content
+    return FileResponse(
+        path,
+        media_type="video/mp4",
+        filename=file_id,
+        content_disposition_type="attachment" if download else "inline"
+    )
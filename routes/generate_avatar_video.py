@@ -1,7 +1,8 @@
 from fastapi import HTTPException, Form, APIRouter, Request
 from pydantic import BaseModel
+from typing import Literal
+import asyncio
 import os
-import time
 import gc
 import requests
 import tempfile
@@ -10,13 +11,16 @@ import json
 from urllib.parse import urlparse
 import config
 from utils.logging_setup import logger
-from utils.file_handler import download_file, check_file_size, clean_temp_files
-from services.google_drive import upload_to_drive
-import whisper
+from utils.file_handler import download_file, create_workspace, remove_workspace
+from services.storage import get_storage
+from services.metrics import track_stage
+from services.jobs import submit_job
+from services import heygen
+from services.subtitle_alignment import align_script
+from services.compositing import render_avatar_video
+from utils.ffmpeg import run_ffmpeg
 from moviepy import AudioFileClip
-from rembg import remove
 from PIL import Image
-import glob
 
 router = APIRouter()
 
@@ -25,31 +29,21 @@ class AvatarVideoRequest(BaseModel):
     input_text: str
     avatar_id: str
     voice_id: str
-
-# HeyGen API configuration
-HEYGEN_API_KEY = os.getenv("HEYGEN_API_KEY")
-HEYGEN_BASE_URL = "https://api.heygen.com"
-HEYGEN_HEADERS = {
-    "Accept": "application/json",
-    "X-Api-Key": HEYGEN_API_KEY
-}
+    background_removal: Literal["colorkey", "ml", "auto"] = config.BACKGROUND_REMOVAL_MODE
+    subtitles: Literal["script", "whisper"] = config.SUBTITLE_ALIGNMENT_MODE
 
 @router.post("/generate-avatar-video")
 async def generate_avatar_video(request: AvatarVideoRequest):
-    image_url = request.image_url
-    input_text = request.input_text
-    avatar_id = request.avatar_id
-    voice_id = request.voice_id
-
     """Generate video from image with AI avatar generated from input text"""
     
-    timestamp = int(time.time())
-    temp_files = []
+    workspace = create_workspace("avatar")
     
     try:
-        # Download image
+        # Fetch and check the image before paying for a HeyGen render
         logger.info("Downloading image...")
-        image_data, image_format = download_file(image_url, is_audio=False)
+        image_path, image_format = await asyncio.to_thread(
+            download_file, request.image_url, os.path.join(workspace, "image"), is_audio=False
+        )
         
         # Validate image format
         if image_format not in config.SUPPORTED_IMAGE_FORMATS:
@@ -57,37 +51,46 @@ async def generate_avatar_video(request: AvatarVideoRequest):
                 status_code=400,
                 detail=f"Unsupported image format: {image_format}"
             )
-
-        # Create temporary file paths
-        image_path = os.path.join(config.TEMP_DIR, f"temp_image_{timestamp}.{image_format}")
-        avatar_video_path = os.path.join(config.TEMP_DIR, f"avatar_video_{timestamp}.mp4")
-        avatar_audio_path = os.path.join(config.TEMP_DIR, f"avatar_audio_{timestamp}.wav")
-        transparent_avatar_path = os.path.join(config.TEMP_DIR, f"transparent_avatar_{timestamp}.mp4")
-        final_video_path = os.path.join(config.TEMP_DIR, f"output_video_{timestamp}.mp4")
-        
-        temp_files.extend([image_path, avatar_video_path, avatar_audio_path, transparent_avatar_path, final_video_path])
-
-        # Save downloaded image
-        with open(image_path, 'wb') as f:
-            f.write(image_data)
-
-        # Check file size
-        check_file_size(image_path)
-
-        # Verify file exists
-        if not os.path.exists(image_path):
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to save temporary image file"
-            )
         
         # Generate HeyGen avatar video
         logger.info("Generating AI avatar video through HeyGen...")
-        video_id = generate_heygen_video(input_text, avatar_id, voice_id)
+        video_id = await heygen.generate_video(request.input_text, request.avatar_id, request.voice_id)
         
-        # Poll until video is ready and get download URL
+        # Wait for HeyGen without holding a thread, then render on a worker
         logger.info(f"Waiting for HeyGen video {video_id} to complete...")
-        avatar_video_url, duration = poll_video_status(video_id)
+        avatar_video_url, duration = await heygen.wait_for_video(video_id)
+        
+        # The job owns the workspace from here on, even if this request goes away
+        job = submit_job(
+            "generate-avatar-video", process_avatar_video,
+            request, image_path, image_format, avatar_video_url, duration, workspace
+        )
+        handed_off, workspace = workspace, None
+        job["future"].add_done_callback(lambda future: future.cancelled() and remove_workspace(handed_off))
+        return await asyncio.wrap_future(job["future"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in generate_avatar_video: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing request: {str(e)}"
+        )
+    finally:
+        # Clean up the workspace if it was never handed to the job
+        if workspace:
+            remove_workspace(workspace)
+
+
+def process_avatar_video(request: AvatarVideoRequest, image_path: str, image_format: str,
+                         avatar_video_url: str, duration: float, workspace: str) -> dict:
+    """Download the finished avatar, composite it over the image and upload (runs on a render worker)"""
+    
+    try:
+        # Create temporary file paths
+        avatar_video_path = os.path.join(workspace, "avatar_video.mp4")
+        avatar_audio_path = os.path.join(workspace, "avatar_audio.wav")
+        final_video_path = os.path.join(workspace, "output_video.mp4")
         
         # Download the avatar video
         logger.info(f"Downloading avatar video from: {avatar_video_url}")
@@ -97,17 +100,17 @@ async def generate_avatar_video(request: AvatarVideoRequest):
         logger.info("Extracting audio from avatar video...")
         extract_audio_from_video(avatar_video_path, avatar_audio_path)
         
-        # Remove white background from avatar video
-        logger.info("Removing white background from avatar video...")
-        remove_background(avatar_video_path, transparent_avatar_path)
-        
-        # Create final video with avatar overlay and subtitles
+        # Create final video with the avatar composited over the image, plus subtitles
         logger.info("Creating final video with avatar overlay and subtitles...")
-        create_video_with_avatar_overlay(image_path, transparent_avatar_path, avatar_audio_path, final_video_path)
+        _, background_stats = create_video_with_avatar_overlay(
+            image_path, avatar_video_path, avatar_audio_path, final_video_path, workspace,
+            request.background_removal, request.input_text, request.subtitles
+        )
         
-        # Upload to Google Drive
-        logger.info("Uploading video to Google Drive...")
-        drive_links = upload_to_drive(final_video_path)
+        # Upload to the configured storage backend
+        logger.info("Uploading video to storage...")
+        with track_stage("upload"):
+            storage_links = get_storage().upload(final_video_path)
         
         # Clean up memory
         gc.collect()
@@ -115,9 +118,10 @@ async def generate_avatar_video(request: AvatarVideoRequest):
         return {
             "status": "success",
             "message": "Avatar video created and uploaded successfully",
-            "video_url": drive_links["shareable_link"],
-            "download_url": drive_links["download_link"],
+            "video_url": storage_links["shareable_link"],
+            "download_url": storage_links["download_link"],
             "duration": duration,
+            "background_removal": background_stats,
             "detected_formats": {
                 "image": image_format
             }
@@ -130,97 +134,33 @@ async def generate_avatar_video(request: AvatarVideoRequest):
             detail=f"Error processing request: {str(e)}"
         )
     finally:
-        # Clean up temporary files
-        clean_temp_files(temp_files)
-
+        # Clean up the request workspace
+        remove_workspace(workspace)
 
-def generate_heygen_video(input_text, avatar_id, voice_id):
-    """Generate avatar video using HeyGen API"""
-    
-    payload = {
-        "video_inputs": [
-            {
-                "character": {
-                    "type": "avatar",
-                    "avatar_id": avatar_id,
-                    "avatar_style": "normal"
-                },
-                "voice": {
-                    "type": "text",
-                    "input_text": input_text,
-                    "voice_id": voice_id,
-                    "speed": 1.0,
-                    "pitch": 1.0
-                }
-            }
-        ],
-        "dimension": {
-            "width": 1280,
-            "height": 720
-        }
-    }
 
-    response = requests.post(
-        f"{HEYGEN_BASE_URL}/v2/video/generate", 
-        headers=HEYGEN_HEADERS, 
-        json=payload
-    )
-    
-    if response.status_code != 200:
-        logger.error(f"HeyGen API error: {response.text}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to generate avatar video: {response.text}"
-        )
+@router.post("/heygen/webhook")
+async def heygen_webhook(request: Request):
+    """Completion callback from HeyGen: wakes the request waiting on that video"""
+    body = await request.body()
+    if not heygen.verify_webhook(body, request.headers.get("signature")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
     
-    response_data = response.json()
+    try:
+        event = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not JSON")
     
-    if response_data.get("error"):
-        raise HTTPException(
-            status_code=500,
-            detail=f"HeyGen API error: {response_data['error']}"
-        )
+    video_id = (event.get("event_data") or {}).get("video_id")
+    logger.info(f"HeyGen webhook {event.get('event_type')} for video {video_id}")
     
-    return response_data["data"]["video_id"]
+    # The waiting request re-checks the status itself, so a stray or
+    # duplicate event costs one extra poll at most
+    return {"status": "ok", "matched": bool(video_id) and heygen.notify_video_event(video_id)}
 
 
-def poll_video_status(video_id, max_retries=100, retry_delay=25):
-    """Poll the video status until it's completed or timeout"""
-    
-    for _ in range(max_retries):
-        status_url = f"{HEYGEN_BASE_URL}/v1/video_status.get?video_id={video_id}"
-        response = requests.get(status_url, headers=HEYGEN_HEADERS)
-        
-        if response.status_code != 200:
-            logger.error(f"Error checking video status: {response.text}")
-            time.sleep(retry_delay)
-            continue
-        
-        status_data = response.json()
-        
-        if status_data["code"] != 100:
-            logger.error(f"HeyGen status code error: {status_data}")
-            time.sleep(retry_delay)
-            continue
-            
-        if status_data["data"]["status"] == "completed":
-            video_url = status_data["data"]["video_url"]
-            duration = status_data["data"]["duration"]
-            return video_url, duration
-        
-        if status_data["data"]["status"] == "failed" or status_data["data"]["error"]:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Avatar video generation failed: {status_data['data'].get('error', 'Unknown error')}"
-            )
-            
-        logger.info(f"Video status: {status_data['data']['status']}. Waiting {retry_delay} seconds...")
-        time.sleep(retry_delay)
-    
-    raise HTTPException(
-        status_code=500,
-        detail=f"Timeout waiting for avatar video to complete processing"
-    )
+@router.on_event("shutdown")
+async def close_heygen_client():
+    await heygen.close_client()
 
 
 def download_heygen_video(url, output_path):
@@ -250,7 +190,7 @@ def extract_audio_from_video(video_path, audio_path):
     ]
     
     try:
-        subprocess.run(command, check=True, capture_output=True)
+        run_ffmpeg("extract_audio", command, check=True, capture_output=True)
     except subprocess.CalledProcessError as e:
         logger.error(f"FFmpeg error: {e.stderr.decode()}")
         raise HTTPException(
@@ -289,83 +229,6 @@ def extract_audio_from_video(video_path, audio_path):
 #         os.remove(f)
 #     os.rmdir(temp_dir)
 
-def remove_background(input_video: str, output_video: str, temp_dir: str = "temp_frames"):
-    """Remove background from video frames and create a transparent video"""
-    # Create temp directory
-    os.makedirs(temp_dir, exist_ok=True)
-    temp_files = []
-    
-    try:
-        # Step 1: Extract frames
-        logger.info("Extracting frames from avatar video...")
-        subprocess.run([
-            "ffmpeg", "-i", input_video,
-            os.path.join(temp_dir, "frame_%04d.png"),
-            "-hide_banner", "-loglevel", "error"
-        ], check=True)
-        
-        # Step 2: Process each frame - remove background
-        logger.info("Removing background from frames...")
-        frame_files = sorted(glob.glob(os.path.join(temp_dir, "frame_*.png")))
-        if not frame_files:
-            raise HTTPException(status_code=500, detail="No frames extracted from video")
-            
-        for frame_path in frame_files:
-            with open(frame_path, "rb") as i:
-                input_img = i.read()
-                output_img = remove(input_img)  # rembg removes background
-                with open(frame_path, "wb") as o:
-                    o.write(output_img)
-        
-        # Step 3: Rebuild video from processed frames with alpha channel
-        logger.info("Creating transparent video from processed frames...")
-        
-        # Get original video framerate for more accurate reproduction
-        fps_output = subprocess.check_output([
-            "ffprobe", "-v", "error", "-select_streams", "v", "-of", 
-            "default=noprint_wrappers=1:nokey=1", "-show_entries", "stream=r_frame_rate", 
-            input_video
-        ]).decode().strip()
-        
-        # Parse fps (usually in format "30000/1001" or similar)
-        if '/' in fps_output:
-            num, den = map(int, fps_output.split('/'))
-            fps = num / den
-        else:
-            fps = float(fps_output)
-        
-        # Ensure fps is a reasonable value
-        if fps <= 0 or fps > 120:
-            fps = 30  # Default fallback
-        
-        # Create video with transparency
-        subprocess.run([
-            "ffmpeg", "-framerate", str(fps), 
-            "-i", os.path.join(temp_dir, "frame_%04d.png"),
-            "-c:v", "libx264", 
-            "-pix_fmt", "yuva420p", 
-            "-filter:v", "scale=trunc(iw/2)*2:trunc(ih/2)*2",  # Ensure dimensions are even (required by yuva420p)
-            "-shortest",
-            "-movflags", "+faststart",
-            "-y", output_video
-        ], check=True)
-        
-        # Verify output was created
-        if not os.path.exists(output_video) or os.path.getsize(output_video) < 1000:
-            raise HTTPException(status_code=500, detail="Failed to create transparent avatar video")
-        
-    except subprocess.CalledProcessError as e:
-        error_message = e.stderr.decode() if hasattr(e, 'stderr') and e.stderr else str(e)
-        logger.error(f"FFmpeg error in remove_background: {error_message}")
-        raise HTTPException(status_code=500, detail=f"Error removing background: {error_message}")
-    finally:
-        # Clean up temporary files
-        for f in glob.glob(os.path.join(temp_dir, "*.png")):
-            os.remove(f)
-        if os.path.exists(temp_dir):
-            os.rmdir(temp_dir)
-
-
 # def create_video_with_avatar_overlay(image_path, avatar_path, audio_path, output_path):
 #     """Create final video with avatar overlay and subtitles using FFmpeg"""
 #     try:
@@ -475,17 +338,22 @@ def remove_background(input_video: str, output_video: str, temp_dir: str = "temp
 #             detail=f"Error creating video with avatar: {str(e)}"
 #         )
 
-def create_video_with_avatar_overlay(image_path, avatar_path, audio_path, output_path):
-    """Create final video with avatar overlay and subtitles using FFmpeg"""
+def create_video_with_avatar_overlay(image_path, avatar_video_path, audio_path, output_path, workspace,
+                                     background_removal=config.BACKGROUND_REMOVAL_MODE, script=None,
+                                     subtitles=config.SUBTITLE_ALIGNMENT_MODE):
+    """Create final video with avatar overlay and subtitles in a single encode, with intermediates in workspace.
+
+    With a script and subtitles="script" the cues come from the known text
+    timed against the audio, and Whisper is never loaded.
+    """
     try:
-        # Load Whisper model for transcription
-        logger.info("Loading Whisper Tiny model...")
-        model = whisper.load_model("tiny")
-        
-        # Transcribe audio from the avatar
-        logger.info("Transcribing audio...")
-        result = model.transcribe(audio_path, verbose=False)
-        segments = result['segments']
+        if script and subtitles == "script":
+            logger.info("Aligning script text to the avatar audio...")
+            segments = align_script(script, audio_path)
+        else:
+            # Imported here so the script path never pulls in Whisper and torch
+            from services.whisper_models import transcribe_audio
+            segments = transcribe_audio(audio_path)
         
         # Get audio duration
         audio_clip = AudioFileClip(audio_path)
@@ -493,8 +361,7 @@ def create_video_with_avatar_overlay(image_path, avatar_path, audio_path, output
         audio_clip.close()
         
         # Create temporary subtitle file
-        timestamp = int(time.time())
-        srt_path = os.path.join(config.TEMP_DIR, f"sub_{timestamp}.srt")
+        srt_path = os.path.join(workspace, "subtitles.srt")
         
         logger.info(f"Creating subtitle file at: {srt_path}")
         with open(srt_path, "w", encoding="utf-8") as srt_file:
@@ -504,74 +371,22 @@ def create_video_with_avatar_overlay(image_path, avatar_path, audio_path, output
                 text = seg['text'].strip()
                 srt_file.write(f"{i}\n{start} --> {end}\n{text}\n\n")
         
-        # Create a temporary video from image and avatar without subtitles first
-        logger.info("Creating video with avatar overlay...")
-        temp_video = os.path.join(config.TEMP_DIR, f"temp_{timestamp}.mp4")
-        
-        # Combine background image with transparent avatar overlay
-        # The key is to ensure the avatar's alpha channel is respected
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-loop", "1", "-i", image_path,
-            "-i", avatar_path,
-            "-i", audio_path,
-            "-filter_complex",
-            "[0:v]scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2[bg];"
-            "[1:v]format=yuva420p,scale=480:-1[avatar];"  # Ensure format maintains alpha
-            "[bg][avatar]overlay=W-w-50:H-h-70:format=yuv420p[outv]",  # Position higher up (70px from bottom)
-            "-map", "[outv]",
-            "-map", "2:a",
-            "-c:v", "libx264",
-            "-c:a", "aac",
-            "-shortest",
-            temp_video
-        ], check=True)
-        
-        # Create a simpler method for subtitles - burn them directly on the video
-        logger.info("Adding subtitles and watermark to video...")
-        
-        # Create a temporary file with simpler name in a known location
-        temp_srt = "temp_sub.srt"
-        with open(temp_srt, "w", encoding="utf-8") as f:
-            with open(srt_path, "r", encoding="utf-8") as original:
-                f.write(original.read())
-        
-        # Now use the watermark if it exists
-        watermark_path = "watermark.png"
-        if os.path.exists(watermark_path):
-            # Use a simpler filter chain for both subtitles and watermark
-            # Position watermark higher up (50px from bottom)
-            subprocess.run([
-                "ffmpeg", "-y",
-                "-i", temp_video,
-                "-i", watermark_path,
-                "-filter_complex",
-                f"subtitles=temp_sub.srt[sub];[1:v]scale=iw*0.15:-1[wm];[sub][wm]overlay=10:H-h-50[v]",
-                "-map", "[v]",
-                "-map", "0:a",
-                "-c:a", "copy",
-                output_path
-            ], check=True)
-        else:
-            # Just add subtitles if no watermark
-            subprocess.run([
-                "ffmpeg", "-y",
-                "-i", temp_video,
-                "-vf", "subtitles=temp_sub.srt",
-                "-c:a", "copy",
-                output_path
-            ], check=True)
+        # Blend the segmented avatar onto the background frame by frame and
+        # encode once, burning in subtitles and the watermark on the way
+        logger.info("Compositing avatar, subtitles and watermark...")
+        background_stats = render_avatar_video(
+            image_path, avatar_video_path, audio_path, srt_path, output_path, background_removal,
+            duration=duration
+        )
         
         # Clean up temporary files
-        if os.path.exists(temp_video):
-            os.remove(temp_video)
         if os.path.exists(srt_path):
             os.remove(srt_path)
-        if os.path.exists(temp_srt):
-            os.remove(temp_srt)
         
-        return duration
+        return duration, background_stats
         
+    except HTTPException:
+        raise
     except subprocess.CalledProcessError as e:
         error_message = e.stderr.decode() if hasattr(e, 'stderr') and e.stderr else str(e)
         logger.error(f"FFmpeg error: {error_message}")
@@ -600,16 +415,10 @@ def format_timestamp(seconds: float) -> str:
 async def get_available_voices():
     """Get available voices from HeyGen"""
     try:
-        response = requests.get(f"{HEYGEN_BASE_URL}/v2/voices", headers=HEYGEN_HEADERS)
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code, 
-                detail="Failed to fetch voices from HeyGen"
-            )
-        return response.json()
+        return await heygen.list_voices()
     except Exception as e:
         logger.error(f"Error getting voices: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Error fetching voices: {str(e)}"
-        )
\ No newline at end of file
+        )
@@ -1,12 +1,15 @@
-from fastapi import HTTPException, Form, APIRouter
+from fastapi import HTTPException, Form, Header, APIRouter
+from concurrent.futures import wait
 import os
-import time
 import gc
+import threading
 import config
 from utils.logging_setup import logger
-from utils.file_handler import download_file, check_file_size, clean_temp_files
-from services.google_drive import upload_to_drive
-from services.video import create_video, concat_videos
+from utils.file_handler import download_files, submit_download, create_workspace, remove_workspace, clean_temp_files
+from services.storage import get_storage
+from services.metrics import track_stage
+from services.video import create_video, create_video_streaming, concat_videos
+from services.jobs import run_job, submit_batch
 
 
 router = APIRouter()
@@ -14,20 +17,25 @@ router = APIRouter()
 @router.post("/generate-video")
 async def generate_video(
     image_url: str = Form(...),
-    audio_url: str = Form(...)
+    audio_url: str = Form(...),
+    x_profile: bool = Header(False)
 ):
     """Generate video from image and audio URLs"""
+    return await run_job("generate-video", process_video, image_url, audio_url, profile=x_profile)
+
+
+def process_video(image_url: str, audio_url: str) -> dict:
+    """Download inputs, render the video and upload it (runs on a render worker)"""
     
-    timestamp = int(time.time())
-    temp_files = []
+    workspace = create_workspace()
     
     try:
-        # Download files and detect formats
-        logger.info("Downloading image...")
-        image_data, image_format = download_file(image_url, is_audio=False)
-        
-        logger.info("Downloading audio...")
-        audio_data, audio_format = download_file(audio_url, is_audio=True)
+        # Download image and audio concurrently straight into the workspace
+        logger.info("Downloading image and audio...")
+        (image_path, image_format), (audio_path, audio_format) = download_files([
+            (image_url, os.path.join(workspace, "image"), False),
+            (audio_url, os.path.join(workspace, "audio"), True)
+        ])
         
         # Validate formats
         if image_format not in config.SUPPORTED_IMAGE_FORMATS:
@@ -42,37 +50,24 @@ async def generate_video(
                 detail=f"Unsupported audio format: {audio_format}"
             )
 
-        # Create temporary file paths
-        image_path = os.path.join(config.TEMP_DIR, f"temp_image_{timestamp}.{image_format}")
-        audio_path = os.path.join(config.TEMP_DIR, f"temp_audio_{timestamp}.{audio_format}")
-        video_path = os.path.join(config.TEMP_DIR, f"output_video_{timestamp}.mp4")
-        
-        temp_files.extend([image_path, audio_path, video_path])
-
-        # Save downloaded files
-        with open(image_path, 'wb') as f:
-            f.write(image_data)
-        
-        with open(audio_path, 'wb') as f:
-            f.write(audio_data)
-
-        # Check file sizes
-        check_file_size(image_path)
-        check_file_size(audio_path)
-
-        # Verify files exist
-        if not os.path.exists(image_path) or not os.path.exists(audio_path):
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to save temporary files"
+        if config.STREAMING_UPLOAD:
+            # Upload fragmented MP4 bytes while ffmpeg is still encoding
+            storage = get_storage()
+            final_duration, storage_links = create_video_streaming(
+                image_path, audio_path, workspace,
+                lambda chunks: storage.upload_stream(chunks, "output_video.mp4")
             )
+        else:
+            # Create output file path
+            video_path = os.path.join(workspace, "output_video.mp4")
 
-        # Create video
-        final_duration = create_video(image_path, audio_path, video_path)
-        
-        # Upload to Google Drive
-        logger.info("Uploading video to Google Drive...")
-        drive_links = upload_to_drive(video_path)
+            # Create video
+            final_duration = create_video(image_path, audio_path, video_path, workspace)
+            
+            # Upload to the configured storage backend
+            logger.info("Uploading video to storage...")
+            with track_stage("upload"):
+                storage_links = get_storage().upload(video_path)
         
         # Clean up memory
         gc.collect()
@@ -80,8 +75,8 @@ async def generate_video(
         return {
             "status": "success",
             "message": "Video created and uploaded successfully",
-            "video_url": drive_links["shareable_link"],
-            "download_url": drive_links["download_link"],
+            "video_url": storage_links["shareable_link"],
+            "download_url": storage_links["download_link"],
             "duration": final_duration,
             "detected_formats": {
                 "image": image_format,
@@ -90,14 +85,14 @@ async def generate_video(
         }
             
     except Exception as e:
-        logger.error(f"Error in generate_video: {str(e)}")
+        logger.error(f"Error in process_video: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Error processing request: {str(e)}"
         )
     finally:
-        # Clean up temporary files
-        clean_temp_files(temp_files)
+        # Clean up the request workspace
+        remove_workspace(workspace)
 
 
 @router.get("/supported-formats")
@@ -118,16 +113,24 @@ class VideoWithPrefixRequest(BaseModel):
 
 
 @router.post("/generate-video-with-prefix")
-async def generate_video_with_prefix(request: VideoWithPrefixRequest):
+async def generate_video_with_prefix(request: VideoWithPrefixRequest, x_profile: bool = Header(False)):
     """Generate video from image and audio URLs with a prefix video"""
+    return await run_job("generate-video-with-prefix", process_video_with_prefix, request, profile=x_profile)
+
+
+def process_video_with_prefix(request: VideoWithPrefixRequest) -> dict:
+    """Download inputs, render, prepend the prefix video and upload (runs on a render worker)"""
     
-    timestamp = int(time.time())
-    temp_files = []
+    workspace = create_workspace()
     
     try:
-        # Download prefix video from Google Drive
-        logger.info("Downloading prefix video...")
-        prefix_video_data, prefix_format = download_file(request.prefix_video_url, is_audio=False)
+        # Download prefix video, image and audio concurrently
+        logger.info("Downloading prefix video, image and audio...")
+        (prefix_video_path, prefix_format), (image_path, image_format), (audio_path, audio_format) = download_files([
+            (request.prefix_video_url, os.path.join(workspace, "prefix"), False),
+            (request.image_url, os.path.join(workspace, "image"), False),
+            (request.audio_url, os.path.join(workspace, "audio"), True)
+        ])
         
         # Validate prefix video format
         if prefix_format not in ['mp4', 'mov', 'avi', 'mkv']:
@@ -136,13 +139,6 @@ async def generate_video_with_prefix(request: VideoWithPrefixRequest):
                 detail=f"Unsupported prefix video format: {prefix_format}"
             )
         
-        # Download files and detect formats
-        logger.info("Downloading image...")
-        image_data, image_format = download_file(request.image_url, is_audio=False)
-        
-        logger.info("Downloading audio...")
-        audio_data, audio_format = download_file(request.audio_url, is_audio=True)
-        
         # Validate formats
         if image_format not in config.SUPPORTED_IMAGE_FORMATS:
             raise HTTPException(
@@ -156,33 +152,13 @@ async def generate_video_with_prefix(request: VideoWithPrefixRequest):
                 detail=f"Unsupported audio format: {audio_format}"
             )
 
-        # Create temporary file paths
-        prefix_video_path = os.path.join(config.TEMP_DIR, f"temp_prefix_{timestamp}.{prefix_format}")
-        image_path = os.path.join(config.TEMP_DIR, f"temp_image_{timestamp}.{image_format}")
-        audio_path = os.path.join(config.TEMP_DIR, f"temp_audio_{timestamp}.{audio_format}")
-        generated_video_path = os.path.join(config.TEMP_DIR, f"generated_video_{timestamp}.mp4")
-        final_video_path = os.path.join(config.TEMP_DIR, f"final_video_{timestamp}.mp4")
-        
-        temp_files.extend([prefix_video_path, image_path, audio_path, generated_video_path, final_video_path])
-
-        # Save downloaded files
-        with open(prefix_video_path, 'wb') as f:
-            f.write(prefix_video_data)
-            
-        with open(image_path, 'wb') as f:
-            f.write(image_data)
-        
-        with open(audio_path, 'wb') as f:
-            f.write(audio_data)
-
-        # Check file sizes
-        check_file_size(prefix_video_path)
-        check_file_size(image_path)
-        check_file_size(audio_path)
+        # Create output file paths
+        generated_video_path = os.path.join(workspace, "generated_video.mp4")
+        final_video_path = os.path.join(workspace, "final_video.mp4")
 
         # Create main video with subtitles
         logger.info("Creating main video...")
-        main_duration = create_video(image_path, audio_path, generated_video_path)
+        main_duration = create_video(image_path, audio_path, generated_video_path, workspace)
         
         # Concatenate prefix video with generated video
         logger.info("Concatenating videos...")
@@ -190,13 +166,15 @@ async def generate_video_with_prefix(request: VideoWithPrefixRequest):
         
         # Get total duration
         from moviepy import VideoFileClip
-        final_clip = VideoFileClip(final_video_path)
-        total_duration = final_clip.duration
-        final_clip.close()
+        with track_stage("duration_probe"):
+            final_clip = VideoFileClip(final_video_path)
+            total_duration = final_clip.duration
+            final_clip.close()
         
-        # Upload to Google Drive
-        logger.info("Uploading final video to Google Drive...")
-        drive_links = upload_to_drive(final_video_path)
+        # Upload to the configured storage backend
+        logger.info("Uploading final video to storage...")
+        with track_stage("upload"):
+            storage_links = get_storage().upload(final_video_path)
         
         # Clean up memory
         gc.collect()
@@ -204,8 +182,8 @@ async def generate_video_with_prefix(request: VideoWithPrefixRequest):
         return {
             "status": "success",
             "message": "Video with prefix created and uploaded successfully",
-            "video_url": drive_links["shareable_link"],
-            "download_url": drive_links["download_link"],
+            "video_url": storage_links["shareable_link"],
+            "download_url": storage_links["download_link"],
             "total_duration": total_duration,
             "main_video_duration": main_duration,
             "detected_formats": {
@@ -216,11 +194,186 @@ async def generate_video_with_prefix(request: VideoWithPrefixRequest):
         }
             
     except Exception as e:
-        logger.error(f"Error in generate_video_with_prefix: {str(e)}")
+        logger.error(f"Error in process_video_with_prefix: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Error processing request: {str(e)}"
         )
     finally:
-        # Clean up temporary files
-        clean_temp_files(temp_files)
+        # Clean up the request workspace
+        remove_workspace(workspace)
+
+
+class BatchVideoItem(BaseModel):
+    image_url: str
+    audio_url: str
+    prefix_video_url: str | None = None
+
+
+class BatchAssets:
+    """The distinct downloads of a batch, fetched once and shared between items.
+
+    Downloads run at most BATCH_DOWNLOAD_AHEAD items ahead of the finished
+    renders, and each file is deleted once the last item using it is done,
+    so disk use stays bounded however large the batch is.
+    """
+
+    def __init__(self, items: list[BatchVideoItem], workspace: str, ahead: int = config.BATCH_DOWNLOAD_AHEAD):
+        self._workspace = workspace
+        self._ahead = max(1, ahead)
+        self._item_inputs = []
+        self._users = {}
+        for item in items:
+            inputs = {item.image_url: False, item.audio_url: True}
+            if item.prefix_video_url:
+                inputs.setdefault(item.prefix_video_url, False)
+            self._item_inputs.append(inputs)
+            for url in inputs:
+                self._users[url] = self._users.get(url, 0) + 1
+        self._futures = {}
+        self._downloads = 0
+        self._scheduled = 0
+        self._finished = 0
+        self._lock = threading.Lock()
+        with self._lock:
+            self._fill()
+
+    def _submit(self, url: str, is_audio: bool):
+        """Start a download unless it already has one (caller holds _lock)"""
+        if url not in self._futures:
+            path_prefix = os.path.join(self._workspace, f"asset_{self._downloads}")
+            self._futures[url] = submit_download(url, path_prefix, is_audio)
+            self._downloads += 1
+
+    def _fill(self):
+        """Start the downloads of items inside the download-ahead window (caller holds _lock)"""
+        while self._scheduled < min(len(self._item_inputs), self._finished + self._ahead):
+            for url, is_audio in self._item_inputs[self._scheduled].items():
+                self._submit(url, is_audio)
+            self._scheduled += 1
+
+    def get(self, index: int, url: str) -> tuple[str, str]:
+        """Wait for an input of item index, starting it now if it's beyond the window"""
+        with self._lock:
+            self._submit(url, self._item_inputs[index][url])
+            future = self._futures[url]
+        return future.result()
+
+    def release(self, index: int) -> bool:
+        """Mark item index finished, drop files no other item needs and download further ahead.
+
+        Returns True once every item has finished.
+        """
+        with self._lock:
+            self._finished += 1
+            for url in self._item_inputs[index]:
+                self._users[url] -= 1
+                if self._users[url] == 0 and url in self._futures:
+                    self._futures.pop(url).add_done_callback(_remove_download)
+            self._fill()
+            return self._finished == len(self._item_inputs)
+
+    def cancel(self):
+        """Stop pending downloads and wait for running ones"""
+        with self._lock:
+            futures = list(self._futures.values())
+        for future in futures:
+            future.cancel()
+        wait(futures)
+
+
+def _remove_download(future):
+    if not future.cancelled() and future.exception() is None:
+        clean_temp_files([future.result()[0]])
+
+
+def start_video_batch(items: list[BatchVideoItem], profile: bool = False) -> dict:
+    """Queue one render job per item, sharing each distinct download across the batch"""
+    shared_workspace = create_workspace("batch")
+
+    # Assets shared between items (prefixes, backgrounds, repeated narration)
+    # are fetched a single time into the batch workspace
+    assets = BatchAssets(items, shared_workspace)
+    logger.info(f"Batch of {len(items)} items, downloading up to {config.BATCH_DOWNLOAD_AHEAD} items ahead")
+
+    try:
+        batch = submit_batch(
+            "batch-item", process_batch_item, [(index, item, assets) for index, item in enumerate(items)], profile
+        )
+    except Exception:
+        assets.cancel()
+        remove_workspace(shared_workspace)
+        raise
+
+    # Remove the batch workspace once the last item has finished with it
+    def item_done(index):
+        if assets.release(index):
+            remove_workspace(shared_workspace)
+
+    for index, job in enumerate(batch["jobs"]):
+        job["future"].add_done_callback(lambda _, index=index: item_done(index))
+
+    return batch
+
+
+def process_batch_item(index: int, item: BatchVideoItem, assets: BatchAssets) -> dict:
+    """Render and upload one batch item from the batch's shared downloads (runs on a render worker)"""
+
+    workspace = create_workspace("batch_item")
+
+    try:
+        image_path, image_format = assets.get(index, item.image_url)
+        audio_path, audio_format = assets.get(index, item.audio_url)
+
+        # Validate formats
+        if image_format not in config.SUPPORTED_IMAGE_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported image format: {image_format}"
+            )
+
+        if audio_format not in config.SUPPORTED_AUDIO_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported audio format: {audio_format}"
+            )
+
+        # Create main video with subtitles
+        generated_video_path = os.path.join(workspace, "generated_video.mp4")
+        main_duration = create_video(image_path, audio_path, generated_video_path, workspace)
+        final_video_path = generated_video_path
+        detected_formats = {"image": image_format, "audio": audio_format}
+
+        if item.prefix_video_url:
+            prefix_video_path, prefix_format = assets.get(index, item.prefix_video_url)
+            if prefix_format not in ['mp4', 'mov', 'avi', 'mkv']:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unsupported prefix video format: {prefix_format}"
+                )
+            detected_formats["prefix_video"] = prefix_format
+
+            final_video_path = os.path.join(workspace, "final_video.mp4")
+            concat_videos(prefix_video_path, generated_video_path, final_video_path)
+
+        # Upload to the configured storage backend
+        with track_stage("upload"):
+            storage_links = get_storage().upload(final_video_path)
+
+        return {
+            "status": "success",
+            "video_url": storage_links["shareable_link"],
+            "download_url": storage_links["download_link"],
+            "main_video_duration": main_duration,
+            "detected_formats": detected_formats
+        }
+
+    except Exception as e:
+        logger.error(f"Error in process_batch_item: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing batch item: {str(e)}"
+        )
+    finally:
+        # Clean up the item workspace
+        remove_workspace(workspace)
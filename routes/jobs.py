@@ -0,0 +1,102 @@
+from fastapi import HTTPException, Header, APIRouter
+from pydantic import BaseModel
+import config
+from services.jobs import submit_job, get_job, get_queue_stats, get_batch
+from routes.generate_video import (
+    process_video, process_video_with_prefix, start_video_batch, VideoWithPrefixRequest, BatchVideoItem
+)
+
+router = APIRouter()
+
+
+class VideoJobRequest(BaseModel):
+    image_url: str
+    audio_url: str
+
+
+class VideoBatchRequest(BaseModel):
+    items: list[BatchVideoItem]
+
+
+def _job_response(job: dict) -> dict:
+    response = {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['job_id']}",
+        "result_url": f"/jobs/{job['job_id']}/result"
+    }
+    if job["profile_id"]:
+        response["profile_url"] = f"/profiles/{job['profile_id']}"
+    return response
+
+
+@router.post("/jobs/generate-video", status_code=202)
+def submit_generate_video(request: VideoJobRequest, x_profile: bool = Header(False)):
+    """Queue a video render and return its job id immediately"""
+    job = submit_job("generate-video", process_video, request.image_url, request.audio_url, profile=x_profile)
+    return _job_response(job)
+
+
+@router.post("/jobs/generate-video-with-prefix", status_code=202)
+def submit_generate_video_with_prefix(request: VideoWithPrefixRequest, x_profile: bool = Header(False)):
+    """Queue a video render with a prefix video and return its job id immediately"""
+    job = submit_job("generate-video-with-prefix", process_video_with_prefix, request, profile=x_profile)
+    return _job_response(job)
+
+
+@router.post("/batches/generate-video", status_code=202)
+def submit_video_batch(request: VideoBatchRequest, x_profile: bool = Header(False)):
+    """Queue a batch of renders that share downloads and the render pool"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Batch has no items")
+    if len(request.items) > config.MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch too large: {len(request.items)} items (max {config.MAX_BATCH_ITEMS})"
+        )
+
+    batch = start_video_batch(request.items, x_profile)
+    return {
+        "batch_id": batch["batch_id"],
+        "status_url": f"/batches/{batch['batch_id']}",
+        "jobs": [_job_response(job) for job in batch["jobs"]]
+    }
+
+
+@router.get("/batches/{batch_id}")
+def get_batch_status(batch_id: str):
+    """Get per-item results and failures for a batch"""
+    return get_batch(batch_id)
+
+
+@router.get("/jobs")
+def get_jobs_overview():
+    """Get render pool size and queue depth"""
+    return get_queue_stats()
+
+
+@router.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    """Get the status of a render job"""
+    job = get_job(job_id)
+    return {
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "error": job["error"],
+        "profile_id": job["profile_id"]
+    }
+
+
+@router.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    """Get the result of a finished render job"""
+    job = get_job(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=job["error"]["status_code"], detail=job["error"]["detail"])
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is still {job['status']}")
+    return job["result"]
@@ -0,0 +1,25 @@
+import json
+from fastapi import HTTPException, APIRouter
+from fastapi.responses import FileResponse
+from services.profiling import profile_path
+
+router = APIRouter()
+
+
+@router.get("/profiles/{request_id}")
+def get_profile(request_id: str):
+    """Get the timing summary of a profiled render: Python hot spots and every ffmpeg run"""
+    path = profile_path(request_id, "json")
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {request_id}")
+    with open(path) as f:
+        return json.load(f)
+
+
+@router.get("/profiles/{request_id}/pstats")
+def get_profile_pstats(request_id: str):
+    """Download the raw cProfile data of a profiled render (load with pstats or snakeviz)"""
+    path = profile_path(request_id, "prof")
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {request_id}")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{request_id}.prof")
@@ -0,0 +1,409 @@
+import json
+import multiprocessing
+import os
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, contextmanager
+from itertools import islice
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from fastapi import HTTPException
+from utils.logging_setup import logger
+from utils.ffmpeg import ffmpeg_output, open_ffmpeg
+from services.metrics import BACKGROUND_FRAMES
+from config import (
+    BACKGROUND_REMOVAL_MODE, BACKGROUND_KEY_COLOR, BACKGROUND_KEY_SIMILARITY, BACKGROUND_KEY_BLEND,
+    BACKGROUND_AUTO_SAMPLES, REMBG_MODEL, REMBG_WORKERS, REMBG_BATCH_SIZE,
+    MASK_REUSE_ENABLED, MASK_REUSE_THRESHOLD, MASK_REUSE_MAX_FRAMES
+)
+
+BACKGROUND_REMOVAL_MODES = ("colorkey", "ml", "auto")
+
+# Pixels whose gray level moves by more than this count as changed
+_CHANGED_PIXEL_LEVEL = 16
+
+# One onnxruntime session per model, shared by every request
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Process pool for parallel segmentation; each worker holds its own session
+_pool = None
+_pool_lock = threading.Lock()
+_worker_session = None
+
+
+def get_rembg_session(model: str = REMBG_MODEL):
+    """Return the shared rembg session for a model, loading it on first use"""
+    with _sessions_lock:
+        session = _sessions.get(model)
+        if session is None:
+            logger.info(f"Loading rembg {model} model...")
+            # Imported here so the API starts, and colorkey keeps working,
+            # without rembg and onnxruntime installed
+            from rembg import new_session
+            session = new_session(model)
+            _sessions[model] = session
+        return session
+
+
+def probe_frames(path: str) -> tuple[int, int, str]:
+    """Return the width, height and frame rate (as an ffmpeg rational) of a video"""
+    output = ffmpeg_output("probe_frames", [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate",
+        "-of", "json",
+        path
+    ])
+    stream = json.loads(output)["streams"][0]
+
+    # Fall back to 30 fps when the container reports nonsense
+    frame_rate = stream.get("r_frame_rate", "30/1")
+    num, _, den = frame_rate.partition("/")
+    fps = float(num) / float(den or 1) if float(den or 1) else 0
+    if fps <= 0 or fps > 120:
+        frame_rate = "30"
+    return stream["width"], stream["height"], frame_rate
+
+
+def sample_frames(path: str, width: int, height: int, count: int) -> list[np.ndarray]:
+    """Decode count RGB frames spread evenly over a video"""
+    duration = float(ffmpeg_output("probe_duration", [
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ]).decode().strip() or 0)
+
+    samples = []
+    for i in range(count):
+        data = ffmpeg_output("sample_frame", [
+            "ffmpeg", "-v", "error", "-ss", f"{duration * (i + 0.5) / count:.3f}", "-i", path,
+            "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"
+        ])
+        if len(data) == width * height * 3:
+            samples.append(np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3))
+    return samples
+
+
+def read_frames(pipe, width: int, height: int, channels: int = 3):
+    """Yield frames from a raw video pipe as (height, width, channels) uint8 arrays"""
+    frame_size = width * height * channels
+    while True:
+        data = pipe.read(frame_size)
+        if len(data) < frame_size:
+            return
+        yield np.frombuffer(data, dtype=np.uint8).reshape(height, width, channels)
+
+
+def segment_frame(session, frame: np.ndarray) -> np.ndarray:
+    """Run rembg on an RGB frame and return its (height, width) alpha mask"""
+    from rembg import remove
+    return remove(frame, session=session, only_mask=True)
+
+
+def colorkey_mask(frame: np.ndarray) -> np.ndarray:
+    """Key out BACKGROUND_KEY_COLOR, with the same similarity/blend semantics as ffmpeg's colorkey"""
+    key = np.array([int(BACKGROUND_KEY_COLOR[i:i + 2], 16) for i in (0, 2, 4)], dtype=np.float32)
+    diff = np.sqrt(((frame.astype(np.float32) - key) ** 2).sum(axis=2) / (255 * 255 * 3))
+    if BACKGROUND_KEY_BLEND > 0:
+        alpha = np.clip((diff - BACKGROUND_KEY_SIMILARITY) / BACKGROUND_KEY_BLEND, 0, 1)
+    else:
+        alpha = (diff > BACKGROUND_KEY_SIMILARITY).astype(np.float32)
+    return (alpha * 255).astype(np.uint8)
+
+
+def colorkey_quality_ok(frame: np.ndarray) -> bool:
+    """Cheap check that a color key cleanly separates a frame.
+
+    The border should key out almost entirely (the background is the key
+    color), the subject should cover a plausible share of the frame, and few
+    pixels should be left half transparent (the key is eating into the subject).
+    """
+    mask = colorkey_mask(frame)
+    height, width = mask.shape
+    margin = max(1, min(height, width) // 20)
+    border = np.concatenate([
+        mask[:margin].ravel(), mask[-margin:].ravel(),
+        mask[:, :margin].ravel(), mask[:, -margin:].ravel()
+    ])
+    border_keyed = np.count_nonzero(border < 32) / border.size
+    foreground = np.count_nonzero(mask > 224) / mask.size
+    partial = np.count_nonzero((mask >= 32) & (mask <= 224)) / mask.size
+    return border_keyed >= 0.98 and 0.02 <= foreground <= 0.9 and partial <= 0.05
+
+
+def choose_mode(path: str, width: int, height: int, mode: str = BACKGROUND_REMOVAL_MODE) -> str:
+    """Resolve "auto" to "colorkey" or "ml" by checking sampled frames"""
+    if mode != "auto":
+        return mode
+    samples = sample_frames(path, width, height, BACKGROUND_AUTO_SAMPLES)
+    if samples and all(colorkey_quality_ok(frame) for frame in samples):
+        return "colorkey"
+    return "ml"
+
+
+def cutout(frame: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Combine an RGB frame and its mask into RGBA, blacking out the background like rembg does"""
+    rgb = (frame.astype(np.uint16) * mask[..., None] // 255).astype(np.uint8)
+    return np.dstack((rgb, mask))
+
+
+def _colorkey_frames(frames):
+    for frame in frames:
+        yield frame, colorkey_mask(frame)
+
+
+def _segment_frames(frames):
+    session = get_rembg_session()
+    for frame in frames:
+        yield frame, segment_frame(session, frame)
+
+
+def _init_worker(model: str, threads: int):
+    """Load the worker's own session, limiting it to its share of the cores"""
+    global _worker_session
+    # rembg reads the onnxruntime thread counts from OMP_NUM_THREADS
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    from rembg import new_session
+    _worker_session = new_session(model)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            threads = max(1, (os.cpu_count() or 1) // REMBG_WORKERS)
+            logger.info(f"Starting {REMBG_WORKERS} rembg workers with {threads} threads each...")
+            # Spawn rather than fork: the server process has threads and loaded models
+            _pool = ProcessPoolExecutor(
+                max_workers=REMBG_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(REMBG_MODEL, threads)
+            )
+        return _pool
+
+
+def _ring_views(buf, slots: int, batch_size: int, height: int, width: int) -> tuple[np.ndarray, np.ndarray]:
+    """Map a ring buffer as per-slot frame batches followed by their masks"""
+    frame_bytes = slots * batch_size * height * width * 3
+    frames = np.ndarray((slots, batch_size, height, width, 3), dtype=np.uint8, buffer=buf)
+    masks = np.ndarray((slots, batch_size, height, width), dtype=np.uint8, buffer=buf, offset=frame_bytes)
+    return frames, masks
+
+
+def _segment_slot(shm_name: str, slot: int, count: int, slots: int, batch_size: int,
+                  height: int, width: int) -> int:
+    """Segment the frames in one ring slot in place (runs in a worker process)"""
+    shm = SharedMemory(name=shm_name)
+    frames, masks = _ring_views(shm.buf, slots, batch_size, height, width)
+    try:
+        for i in range(count):
+            masks[slot, i] = segment_frame(_worker_session, frames[slot, i].copy())
+    finally:
+        # The views must be gone before the segment can be closed
+        del frames, masks
+        shm.close()
+    return slot
+
+
+def _segment_frames_parallel(frames, width: int, height: int):
+    """Segment frames across the worker pool, yielding them in their original order.
+
+    Batches of frames go to the workers through a shared-memory ring buffer
+    rather than being pickled, and results are collected in submission order.
+    """
+    pool = _get_pool()
+    slots = REMBG_WORKERS * 2
+    shm = SharedMemory(create=True, size=slots * REMBG_BATCH_SIZE * height * width * 4)
+    ring_frames, ring_masks = _ring_views(shm.buf, slots, REMBG_BATCH_SIZE, height, width)
+    free_slots = deque(range(slots))
+    pending = deque()
+
+    def collect():
+        future, count = pending.popleft()
+        slot = future.result()
+        for i in range(count):
+            yield ring_frames[slot, i].copy(), ring_masks[slot, i].copy()
+        free_slots.append(slot)
+
+    try:
+        frames = iter(frames)
+        while batch := list(islice(frames, REMBG_BATCH_SIZE)):
+            if not free_slots:
+                yield from collect()
+            slot = free_slots.popleft()
+            ring_frames[slot, :len(batch)] = batch
+            future = pool.submit(
+                _segment_slot, shm.name, slot, len(batch), slots, REMBG_BATCH_SIZE, height, width
+            )
+            pending.append((future, len(batch)))
+
+        while pending:
+            yield from collect()
+    finally:
+        # Let in-flight workers finish with the segment before it goes away
+        for future, _ in pending:
+            future.cancel()
+        for future, _ in pending:
+            if not future.cancelled():
+                try:
+                    future.result()
+                except Exception:
+                    pass
+        del ring_frames, ring_masks
+        shm.close()
+        shm.unlink()
+
+
+def changed_fraction(frame: np.ndarray, reference: np.ndarray) -> float:
+    """Fraction of pixels that changed noticeably between two frames, sampled every 4th pixel"""
+    a = frame[::4, ::4].mean(axis=2)
+    b = reference[::4, ::4].mean(axis=2)
+    return float(np.count_nonzero(np.abs(a - b) > _CHANGED_PIXEL_LEVEL)) / a.size
+
+
+def _segment_with_reuse(frames, segment, stats: dict):
+    """Segment only keyframes and give low-motion frames the mask of their keyframe.
+
+    A frame is a keyframe when it differs from the last keyframe by more than
+    MASK_REUSE_THRESHOLD or MASK_REUSE_MAX_FRAMES frames have passed. The
+    decision only looks at frames, so keyframes can still be segmented in
+    parallel; the frames between them wait here until their mask is ready.
+    """
+    followers = deque()
+
+    def keyframes():
+        reference = None
+        since_keyframe = 0
+        for frame in frames:
+            if (
+                reference is not None
+                and since_keyframe < MASK_REUSE_MAX_FRAMES
+                and changed_fraction(frame, reference) <= MASK_REUSE_THRESHOLD
+            ):
+                followers[-1].append(frame)
+                since_keyframe += 1
+                continue
+            reference = frame
+            since_keyframe = 1
+            followers.append([])
+            yield frame
+
+    previous_mask = None
+    with closing(segment(keyframes())) as results:
+        for frame, mask in results:
+            if previous_mask is not None:
+                for follower in followers.popleft():
+                    stats["reused"] += 1
+                    yield follower, previous_mask
+            yield frame, mask
+            previous_mask = mask
+
+    if previous_mask is not None:
+        for follower in followers.popleft():
+            stats["reused"] += 1
+            yield follower, previous_mask
+
+
+@contextmanager
+def open_segmented_frames(input_video: str, mode: str = BACKGROUND_REMOVAL_MODE, scale_width: int | None = None):
+    """Decode a video and separate its frames from the background.
+
+    Yields (info, frames): info holds the frame size, rate and resolved mode,
+    and frames iterates (rgb, mask) pairs. Frames are scaled to scale_width
+    while decoding when given. The caller must consume every frame; info gets
+    the frame and mask-reuse counts once the block exits.
+    """
+    if mode not in BACKGROUND_REMOVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown background removal mode: {mode}")
+
+    width, height, frame_rate = probe_frames(input_video)
+    mode = choose_mode(input_video, width, height, mode)
+    scale_args = []
+    if scale_width:
+        width, height = scale_width, max(2, round(height * scale_width / width / 2) * 2)
+        scale_args = ["-vf", f"scale={width}:{height}"]
+    logger.info(f"Removing background with {mode}")
+    info = {"mode": mode, "width": width, "height": height, "frame_rate": frame_rate, "frames": 0, "reused": 0}
+
+    def segment(frames):
+        if mode == "colorkey":
+            return _colorkey_frames(frames)
+        if REMBG_WORKERS > 0:
+            return _segment_frames_parallel(frames, width, height)
+        return _segment_frames(frames)
+
+    def segmented(frames):
+        # Keying a frame costs less than deciding whether to reuse a mask
+        if MASK_REUSE_ENABLED and mode == "ml":
+            return _segment_with_reuse(frames, segment, info)
+        return segment(frames)
+
+    def counted(results):
+        for result in results:
+            info["frames"] += 1
+            yield result
+
+    with open_ffmpeg("decode_frames", [
+        "ffmpeg", "-v", "error", "-i", input_video, *scale_args,
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"
+    ], stdout=subprocess.PIPE) as decoder:
+        with closing(segmented(read_frames(decoder.stdout, width, height))) as results:
+            yield info, counted(results)
+        if decoder.wait() != 0:
+            raise HTTPException(status_code=500, detail="Failed to decode avatar video frames")
+
+    if info["frames"] == 0:
+        raise HTTPException(status_code=500, detail="No frames decoded from video")
+
+    segmented_count = info["frames"] - info["reused"]
+    BACKGROUND_FRAMES.labels(result="colorkey" if mode == "colorkey" else "segmented").inc(segmented_count)
+    BACKGROUND_FRAMES.labels(result="reused").inc(info["reused"])
+    logger.info(
+        f"Removed background from {info['frames']} frames with {mode} "
+        f"({segmented_count} segmented, {info['reused']} reused a previous mask)"
+    )
+
+
+def background_stats(info: dict) -> dict:
+    """Summarize an open_segmented_frames info dict for API responses"""
+    return {
+        "mode": info["mode"],
+        "frames": info["frames"],
+        "segmented": info["frames"] - info["reused"],
+        "reused": info["reused"]
+    }
+
+
+def remove_background(input_video: str, output_video: str, mode: str = BACKGROUND_REMOVAL_MODE) -> dict:
+    """Remove the background from a video and encode the result with an alpha channel.
+
+    Frames stream from an ffmpeg decoder as raw RGB, through a color key or
+    rembg (see choose_mode), and into the encoder's stdin as raw RGBA, so
+    nothing is written per frame. Returns the mode used, how many frames were
+    processed and how many reused a mask.
+    """
+    try:
+        with open_segmented_frames(input_video, mode) as (info, frames), open_ffmpeg("encode_transparent", [
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{info['width']}x{info['height']}",
+            "-r", info["frame_rate"],
+            "-i", "pipe:0",
+            "-c:v", "libx264",
+            "-pix_fmt", "yuva420p",
+            "-filter:v", "scale=trunc(iw/2)*2:trunc(ih/2)*2",  # yuva420p needs even dimensions
+            "-movflags", "+faststart",
+            output_video
+        ], stdin=subprocess.PIPE) as encoder:
+            for frame, mask in frames:
+                encoder.stdin.write(cutout(frame, mask).tobytes())
+            encoder.stdin.close()
+
+            if encoder.wait() != 0:
+                raise HTTPException(status_code=500, detail="Failed to encode transparent avatar video")
+    except BrokenPipeError:
+        raise HTTPException(status_code=500, detail="Transparent avatar encoder exited early")
+
+    return background_stats(info)
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import numpy as np
+from fastapi import HTTPException
+from utils.ffmpeg import ffmpeg_output, open_ffmpeg
+from services.background_removal import open_segmented_frames, background_stats
+from config import BACKGROUND_REMOVAL_MODE
+
+# Layout of avatar videos: the avatar sits in the lower right of a 1080p canvas
+CANVAS_WIDTH = 1920
+CANVAS_HEIGHT = 1080
+AVATAR_WIDTH = 480
+AVATAR_MARGIN_RIGHT = 50
+AVATAR_MARGIN_BOTTOM = 70
+
+
+def load_background(image_path: str, width: int = CANVAS_WIDTH, height: int = CANVAS_HEIGHT) -> np.ndarray:
+    """Scale and letterbox an image to the canvas once, as an RGB array"""
+    data = ffmpeg_output("scale_background", [
+        "ffmpeg", "-v", "error", "-i", image_path,
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+               f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+        "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"
+    ])
+    return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+
+
+def composite(background: np.ndarray, frame: np.ndarray, mask: np.ndarray, x: int, y: int) -> np.ndarray:
+    """Alpha-blend an RGB frame onto a copy of the background at (x, y)"""
+    output = background.copy()
+    height, width = mask.shape
+    region = output[y:y + height, x:x + width]
+    alpha = mask[..., None].astype(np.uint16)
+    region[:] = (frame * alpha + region * (255 - alpha) + 127) // 255
+    return output
+
+
+def render_avatar_video(image_path: str, avatar_video: str, audio_path: str, srt_path: str,
+                        output_path: str, mode: str = BACKGROUND_REMOVAL_MODE,
+                        duration: float | None = None) -> dict:
+    """Composite the avatar onto the background and encode the final video in one pass.
+
+    Avatar frames are decoded at their on-canvas size, separated from their
+    background, blended onto the pre-scaled background in numpy and piped to
+    a single encoder that also burns subtitles, adds the watermark and muxes
+    the audio. The output is cut to duration when given (else to the shorter
+    input); frames the encoder no longer needs are dropped. Returns the background removal stats.
+    """
+    background = load_background(image_path)
+
+    watermark_path = "watermark.png"
+    if os.path.exists(watermark_path):
+        watermark_args = ["-i", watermark_path]
+        filter_graph = f"[0:v]subtitles={srt_path}[sub];[2:v]scale=iw*0.15:-1[wm];[sub][wm]overlay=10:H-h-50[v]"
+    else:
+        watermark_args = []
+        filter_graph = f"[0:v]subtitles={srt_path}[v]"
+
+    duration_args = ["-t", f"{duration:.3f}"] if duration else ["-shortest"]
+
+    with open_segmented_frames(avatar_video, mode, AVATAR_WIDTH) as (info, frames), open_ffmpeg("avatar_compose", [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{CANVAS_WIDTH}x{CANVAS_HEIGHT}",
+        "-r", info["frame_rate"],
+        "-i", "pipe:0",
+        "-i", audio_path,
+        *watermark_args,
+        "-filter_complex", filter_graph,
+        "-map", "[v]",
+        "-map", "1:a",
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        *duration_args,
+        output_path
+    ], stdin=subprocess.PIPE) as encoder:
+        x = CANVAS_WIDTH - info["width"] - AVATAR_MARGIN_RIGHT
+        y = CANVAS_HEIGHT - info["height"] - AVATAR_MARGIN_BOTTOM
+        try:
+            for frame, mask in frames:
+                encoder.stdin.write(composite(background, frame, mask, x, y).tobytes())
+            encoder.stdin.close()
+        except BrokenPipeError:
+            # The encoder stops reading once the output is complete; whether
+            # that was a success is decided by its return code below
+            pass
+
+        if encoder.wait() != 0:
+            raise HTTPException(status_code=500, detail="Failed to encode avatar video")
+
+    return background_stats(info)
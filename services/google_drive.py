@@ -1,9 +1,27 @@
+import json
 import os
+import threading
+import time
+import httplib2
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import MediaFileUpload, MediaUpload
 from utils.logging_setup import logger
-from config import GOOGLE_DRIVE_SCOPES
+from config import (
+    GOOGLE_DRIVE_SCOPES, DRIVE_API_ENDPOINT, DRIVE_ANONYMOUS, DRIVE_UPLOAD_CHUNK_SIZE,
+    DRIVE_UPLOAD_RETRIES, DRIVE_HTTP_TIMEOUT_SECONDS
+)
+
+# Credentials are shared process-wide; each thread gets its own service
+# object because the underlying httplib2 connection isn't thread-safe
+_credentials = None
+_credentials_lock = threading.Lock()
+_thread_local = threading.local()
+_upload_stats = {"uploads": 0, "failures": 0, "bytes": 0, "seconds": 0.0}
+_stats_lock = threading.Lock()
 
 def get_credentials_dict():
     """Create credentials dictionary from environment variables"""
@@ -30,41 +48,137 @@ def get_credentials_dict():
         "client_x509_cert_url": os.getenv("CLIENT_X509_CERT_URL")
     }
 
+def get_credentials():
+    """Return the shared Drive credentials, creating them on first use"""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            if DRIVE_ANONYMOUS:
+                # Used against a local fake Drive server
+                _credentials = AnonymousCredentials()
+            else:
+                _credentials = service_account.Credentials.from_service_account_info(
+                    get_credentials_dict(),
+                    scopes=GOOGLE_DRIVE_SCOPES
+                )
+        return _credentials
+
 def get_drive_service():
-    """Get Google Drive service using credentials from environment variables"""
+    """Get this thread's Google Drive service, building it on first use"""
+    service = getattr(_thread_local, "service", None)
+    if service is not None:
+        return service
+
     try:
-        credentials_dict = get_credentials_dict()
-        credentials = service_account.Credentials.from_service_account_info(
-            credentials_dict,
-            scopes=GOOGLE_DRIVE_SCOPES
-        )
-        return build('drive', 'v3', credentials=credentials)
+        base_http = httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT_SECONDS)
+        # Drive answers unfinished resumable chunks with 308 Resume Incomplete,
+        # which httplib2 would otherwise treat as a redirect without a Location
+        if hasattr(base_http, "redirect_codes"):
+            base_http.redirect_codes = set(base_http.redirect_codes) - {308}
+        http = AuthorizedHttp(get_credentials(), http=base_http)
+        if DRIVE_API_ENDPOINT:
+            # Upload URLs come from the discovery document's rootUrl and keep
+            # its https scheme even with api_endpoint set, so repoint the
+            # document itself at the endpoint
+            root_url = DRIVE_API_ENDPOINT.rstrip("/") + "/"
+            document = json.loads(get_static_doc('drive', 'v3'))
+            document["rootUrl"] = root_url
+            document["baseUrl"] = root_url + document["servicePath"]
+            service = build_from_document(document, http=http)
+        else:
+            service = build('drive', 'v3', http=http, cache_discovery=False)
+        _thread_local.service = service
+        return service
     except Exception as e:
         logger.error(f"Error setting up Google Drive service: {str(e)}")
         raise
 
+class ChunkStreamUpload(MediaUpload):
+    """Resumable media read from an iterator of byte chunks whose total size isn't known upfront.
+
+    Up to two upload chunks are buffered ahead, so the total is reported as
+    soon as the iterator runs out and the final chunk is sent with it, even
+    when the stream ends exactly on a chunk boundary.
+    """
+
+    def __init__(self, chunks, mime_type: str, chunk_size: int = DRIVE_UPLOAD_CHUNK_SIZE):
+        self._chunks = iter(chunks)
+        self._mime_type = mime_type
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        # Stream offset of the first buffered byte
+        self._offset = 0
+        self._exhausted = False
+
+    def _fill(self, length: int):
+        while not self._exhausted and len(self._buffer) < length:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+            else:
+                self._buffer += chunk
+
+    def chunksize(self):
+        return self._chunk_size
+
+    def mimetype(self):
+        return self._mime_type
+
+    def size(self):
+        self._fill(2 * self._chunk_size + 1)
+        return self._offset + len(self._buffer) if self._exhausted else None
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        # Bytes before begin have been acknowledged by Drive and can go;
+        # anything after it is kept in case the chunk has to be resent
+        del self._buffer[:begin - self._offset]
+        self._offset = begin
+        self._fill(length)
+        return bytes(self._buffer[:length])
+
+
 def upload_to_drive(file_path: str, mime_type: str = 'video/mp4') -> dict:
     """Upload file to Google Drive and return both shareable and download links"""
+    media = MediaFileUpload(
+        file_path,
+        mimetype=mime_type,
+        chunksize=DRIVE_UPLOAD_CHUNK_SIZE,
+        resumable=True
+    )
+    return _upload_media(media, os.path.basename(file_path), mime_type)
+
+def upload_stream_to_drive(chunks, filename: str, mime_type: str = 'video/mp4') -> dict:
+    """Upload an iterator of byte chunks to Google Drive as it is produced"""
+    return _upload_media(ChunkStreamUpload(chunks, mime_type), filename, mime_type)
+
+def _upload_media(media: MediaUpload, filename: str, mime_type: str) -> dict:
+    """Run a resumable upload, share the file with anyone who has the link and return its links"""
+    start = time.perf_counter()
     try:
         service = get_drive_service()
         
         file_metadata = {
-            'name': os.path.basename(file_path),
+            'name': filename,
             'mimeType': mime_type
         }
         
-        media = MediaFileUpload(
-            file_path,
-            mimetype=mime_type,
-            resumable=True
-        )
-        
         logger.info("Uploading file to Google Drive...")
-        file = service.files().create(
+        request = service.files().create(
             body=file_metadata,
             media_body=media,
-            fields='id, webViewLink'
-        ).execute()
+            fields='id'
+        )
+
+        # Each chunk is retried with exponential backoff on 5xx/429 and
+        # connection errors before the upload as a whole fails
+        file = None
+        while file is None:
+            status, file = request.next_chunk(num_retries=DRIVE_UPLOAD_RETRIES)
+            if status:
+                logger.info(f"Upload progress: {int(status.progress() * 100)}%")
         
         permission = {
             'type': 'anyone',
@@ -72,15 +186,42 @@ def upload_to_drive(file_path: str, mime_type: str = 'video/mp4') -> dict:
         }
         service.permissions().create(
             fileId=file.get('id'),
-            body=permission
-        ).execute()
+            body=permission,
+            fields='id'
+        ).execute(num_retries=DRIVE_UPLOAD_RETRIES)
+
+        file_size = media.size()
+        elapsed = time.perf_counter() - start
+        throughput = file_size / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Uploaded {file_size} bytes in {elapsed:.2f}s ({throughput:.2f}MB/s)")
+        with _stats_lock:
+            _upload_stats["uploads"] += 1
+            _upload_stats["bytes"] += file_size
+            _upload_stats["seconds"] += elapsed
         
         file_id = file.get('id')
         return {
             "shareable_link": f"https://drive.google.com/file/d/{file_id}/view",
-            "download_link": f"https://drive.google.com/uc?id={file_id}&export=download"
+            "download_link": f"https://drive.google.com/uc?id={file_id}&export=download",
+            "upload_stats": {
+                "bytes": file_size,
+                "seconds": round(elapsed, 3),
+                "mb_per_second": round(throughput, 3)
+            }
         }
     
     except Exception as e:
+        with _stats_lock:
+            _upload_stats["failures"] += 1
         logger.error(f"Error uploading to Google Drive: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def get_upload_stats() -> dict:
+    """Report aggregate Drive upload counters and throughput"""
+    with _stats_lock:
+        stats = dict(_upload_stats)
+    stats["mb_per_second"] = (
+        round(stats["bytes"] / (1024 * 1024) / stats["seconds"], 3) if stats["seconds"] else None
+    )
+    stats["chunk_size"] = DRIVE_UPLOAD_CHUNK_SIZE
+    return stats
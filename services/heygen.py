@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import hmac
+import httpx
+from fastapi import HTTPException
+from utils.logging_setup import logger
+from config import (
+    HEYGEN_API_KEY, HEYGEN_BASE_URL, HEYGEN_HTTP_TIMEOUT_SECONDS, HEYGEN_MAX_CONNECTIONS,
+    HEYGEN_POLL_INITIAL_SECONDS, HEYGEN_POLL_MAX_SECONDS, HEYGEN_POLL_TIMEOUT_SECONDS,
+    HEYGEN_CALLBACK_URL, HEYGEN_WEBHOOK_SECRET
+)
+
+# One pooled client for the event loop, created on first use
+_client = None
+# Videos being waited on, keyed by video id; the completion webhook sets the event
+_waiters = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=HEYGEN_BASE_URL,
+            headers={"Accept": "application/json", "X-Api-Key": HEYGEN_API_KEY or ""},
+            timeout=HEYGEN_HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=HEYGEN_MAX_CONNECTIONS,
+                max_keepalive_connections=HEYGEN_MAX_CONNECTIONS
+            )
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def generate_video(input_text: str, avatar_id: str, voice_id: str) -> str:
+    """Start rendering an avatar video and return its HeyGen video id"""
+    payload = {
+        "video_inputs": [
+            {
+                "character": {
+                    "type": "avatar",
+                    "avatar_id": avatar_id,
+                    "avatar_style": "normal"
+                },
+                "voice": {
+                    "type": "text",
+                    "input_text": input_text,
+                    "voice_id": voice_id,
+                    "speed": 1.0,
+                    "pitch": 1.0
+                }
+            }
+        ],
+        "dimension": {
+            "width": 1280,
+            "height": 720
+        }
+    }
+    if HEYGEN_CALLBACK_URL:
+        payload["callback_url"] = HEYGEN_CALLBACK_URL
+
+    response = await get_client().post("/v2/video/generate", json=payload)
+    if response.status_code != 200:
+        logger.error(f"HeyGen API error: {response.text}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate avatar video: {response.text}"
+        )
+
+    response_data = response.json()
+    if response_data.get("error"):
+        raise HTTPException(
+            status_code=500,
+            detail=f"HeyGen API error: {response_data['error']}"
+        )
+    return response_data["data"]["video_id"]
+
+
+async def get_video_status(video_id: str) -> dict | None:
+    """Fetch a video's status data, or None when the check itself failed and should be retried"""
+    try:
+        response = await get_client().get("/v1/video_status.get", params={"video_id": video_id})
+    except httpx.HTTPError as e:
+        logger.error(f"Error checking video status: {str(e)}")
+        return None
+
+    if response.status_code != 200:
+        logger.error(f"Error checking video status: {response.text}")
+        return None
+
+    status_data = response.json()
+    if status_data.get("code") != 100:
+        logger.error(f"HeyGen status code error: {status_data}")
+        return None
+    return status_data["data"]
+
+
+async def wait_for_video(video_id: str) -> tuple[str, float]:
+    """Wait for a video to finish and return its download URL and duration.
+
+    Polls with exponential backoff between HEYGEN_POLL_INITIAL_SECONDS and
+    HEYGEN_POLL_MAX_SECONDS, and polls again straight away when the
+    completion webhook reports the video. Waiting holds no thread, so any
+    number of requests can wait on one worker.
+    """
+    event = _waiters.setdefault(video_id, asyncio.Event())
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + HEYGEN_POLL_TIMEOUT_SECONDS
+    delay = HEYGEN_POLL_INITIAL_SECONDS
+
+    try:
+        while True:
+            data = await get_video_status(video_id)
+            if data is not None:
+                if data["status"] == "completed":
+                    return data["video_url"], data["duration"]
+                if data["status"] == "failed" or data.get("error"):
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"Avatar video generation failed: {data.get('error') or 'Unknown error'}"
+                    )
+                logger.info(f"Video {video_id} status: {data['status']}. Checking again in {delay:.0f} seconds...")
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise HTTPException(
+                    status_code=500,
+                    detail="Timeout waiting for avatar video to complete processing"
+                )
+
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(delay, remaining))
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+            delay = min(delay * 2, HEYGEN_POLL_MAX_SECONDS)
+    finally:
+        _waiters.pop(video_id, None)
+
+
+async def list_voices() -> dict:
+    response = await get_client().get("/v2/voices")
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail="Failed to fetch voices from HeyGen"
+        )
+    return response.json()
+
+
+def verify_webhook(body: bytes, signature: str | None) -> bool:
+    """Check a webhook's HMAC-SHA256 signature; everything passes when no secret is configured"""
+    if not HEYGEN_WEBHOOK_SECRET:
+        return True
+    expected = hmac.new(HEYGEN_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return signature is not None and hmac.compare_digest(expected, signature)
+
+
+def notify_video_event(video_id: str) -> bool:
+    """Wake the request waiting on a video; returns whether one was waiting"""
+    event = _waiters.get(video_id)
+    if event is None:
+        return False
+    event.set()
+    return True
@@ -0,0 +1,244 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from fastapi import HTTPException
+from utils.logging_setup import logger
+from services.metrics import RENDERS_IN_FLIGHT, QUEUE_DEPTH
+from services.profiling import profile_request
+from config import (
+    RENDER_WORKERS, MAX_QUEUED_JOBS, MAX_QUEUED_BATCH_JOBS, JOB_RESULT_TTL_SECONDS, PROFILE_RENDERS
+)
+
+# Renders spend their time in ffmpeg/Whisper, which release the GIL, so a
+# thread pool is enough to keep every core busy
+_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+_jobs = {}
+_batches = {}
+_jobs_lock = threading.Lock()
+
+# Jobs waiting for a worker. Every pool task takes the oldest single job, or
+# the oldest batch item when no single job is waiting, so single requests
+# overtake a queued batch instead of waiting behind all of it
+_single_queue = deque()
+_batch_queue = deque()
+
+
+def _queued_count(batch: bool) -> int:
+    return sum(
+        1 for job in _jobs.values()
+        if job["status"] == "queued" and (job["batch_id"] is not None) == batch
+    )
+
+
+def _expire_jobs():
+    """Drop finished jobs whose results have outlived the TTL"""
+    now = time.time()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job["finished_at"] and now - job["finished_at"] > JOB_RESULT_TTL_SECONDS
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+    # A batch goes once none of its items are left
+    for batch_id in [
+        batch_id for batch_id, batch in _batches.items()
+        if not any(job_id in _jobs for job_id in batch["job_ids"])
+    ]:
+        del _batches[batch_id]
+
+
+def _new_job(kind: str, func, args, kwargs, profile: bool = False, batch_id: str | None = None) -> dict:
+    """Register a queued job and hand it to the pool (caller holds _jobs_lock)"""
+    job_id = str(uuid.uuid4())
+    job = {
+        "job_id": job_id,
+        "kind": kind,
+        "batch_id": batch_id,
+        "status": "queued",
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "error": None,
+        "profile_id": job_id if profile or PROFILE_RENDERS else None
+    }
+    job["future"] = Future()
+    _jobs[job_id] = job
+    (_batch_queue if batch_id else _single_queue).append((job_id, func, args, kwargs))
+    _executor.submit(_run_next)
+    return job
+
+
+def _run_next():
+    """Pool task: run the highest-priority waiting job and settle its future"""
+    with _jobs_lock:
+        job_id, func, args, kwargs = (_single_queue or _batch_queue).popleft()
+        job = _jobs[job_id]
+        future = job["future"]
+        if not future.set_running_or_notify_cancel():
+            job["status"] = "cancelled"
+            job["finished_at"] = time.time()
+            return
+
+    try:
+        future.set_result(_run_job(job_id, func, args, kwargs))
+    except Exception as e:
+        future.set_exception(e)
+
+
+def _check_queue_room(count: int, batch: bool = False):
+    """Reject submissions that would push the waiting queue past its limit (caller holds _jobs_lock).
+
+    Single jobs and batch items are limited separately.
+    """
+    queued = _queued_count(batch)
+    if queued + count > (MAX_QUEUED_BATCH_JOBS if batch else MAX_QUEUED_JOBS):
+        raise HTTPException(
+            status_code=429,
+            detail=f"Render queue is full ({queued} jobs waiting), try again later"
+        )
+
+
+def _run_job(job_id: str, func, args, kwargs):
+    """Execute a job on a render worker and record its outcome"""
+    with _jobs_lock:
+        job = _jobs[job_id]
+        job["status"] = "running"
+        job["started_at"] = time.time()
+
+    logger.info(f"Job {job_id} ({job['kind']}) started")
+    RENDERS_IN_FLIGHT.inc()
+    try:
+        if job["profile_id"]:
+            with profile_request(job["profile_id"]):
+                result = func(*args, **kwargs)
+            if isinstance(result, dict):
+                result = {**result, "profile_id": job["profile_id"]}
+        else:
+            result = func(*args, **kwargs)
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        status_code = e.status_code if isinstance(e, HTTPException) else 500
+        with _jobs_lock:
+            job["status"] = "failed"
+            job["error"] = {"status_code": status_code, "detail": detail}
+            job["finished_at"] = time.time()
+        logger.error(f"Job {job_id} failed: {detail}")
+        raise
+    finally:
+        RENDERS_IN_FLIGHT.dec()
+
+    with _jobs_lock:
+        job["status"] = "completed"
+        job["result"] = result
+        job["finished_at"] = time.time()
+    logger.info(f"Job {job_id} completed in {job['finished_at'] - job['started_at']:.2f}s")
+    return result
+
+
+def submit_job(kind: str, func, *args, profile: bool = False, **kwargs) -> dict:
+    """Queue func on the render pool and return the job record.
+
+    With profile set (or PROFILE_RENDERS on) the run is profiled under the job id.
+    """
+    with _jobs_lock:
+        _expire_jobs()
+        _check_queue_room(1)
+        return _new_job(kind, func, args, kwargs, profile)
+
+
+def submit_batch(kind: str, func, items: list[tuple], profile: bool = False) -> dict:
+    """Queue func once per args tuple in items, admitting the whole batch or none of it.
+
+    Every item becomes its own job, so one failure doesn't affect the rest.
+    """
+    with _jobs_lock:
+        _expire_jobs()
+        _check_queue_room(len(items), batch=True)
+        batch_id = str(uuid.uuid4())
+        jobs = [_new_job(kind, func, args, {}, profile, batch_id) for args in items]
+        _batches[batch_id] = {
+            "batch_id": batch_id,
+            "created_at": time.time(),
+            "job_ids": [job["job_id"] for job in jobs]
+        }
+    return {"batch_id": batch_id, "jobs": jobs}
+
+
+def get_batch(batch_id: str) -> dict:
+    """Return per-item status, results and failures for a batch"""
+    with _jobs_lock:
+        batch = _batches.get(batch_id)
+        if batch is None:
+            raise HTTPException(status_code=404, detail=f"Batch not found: {batch_id}")
+
+        items = []
+        counts = {}
+        for index, job_id in enumerate(batch["job_ids"]):
+            job = _jobs.get(job_id)
+            status = job["status"] if job else "expired"
+            counts[status] = counts.get(status, 0) + 1
+            items.append({
+                "index": index,
+                "job_id": job_id,
+                "status": status,
+                "result": job["result"] if job else None,
+                "error": job["error"] if job else None
+            })
+
+    return {
+        "batch_id": batch_id,
+        "created_at": batch["created_at"],
+        "total": len(items),
+        "done": counts.get("completed", 0) + counts.get("failed", 0) + counts.get("cancelled", 0) == len(items),
+        "counts": counts,
+        "items": items
+    }
+
+
+async def run_job(kind: str, func, *args, profile: bool = False, **kwargs):
+    """Run func on the render pool and wait for it without blocking the event loop"""
+    job = submit_job(kind, func, *args, profile=profile, **kwargs)
+    return await asyncio.wrap_future(job["future"])
+
+
+def get_job(job_id: str) -> dict:
+    """Return a public snapshot of a job"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+        return {key: value for key, value in job.items() if key != "future"}
+
+
+def get_queue_stats() -> dict:
+    """Summarize the render pool and queue"""
+    with _jobs_lock:
+        _expire_jobs()
+        counts = {}
+        for job in _jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+
+    return {
+        "workers": RENDER_WORKERS,
+        "max_queued_jobs": MAX_QUEUED_JOBS,
+        "max_queued_batch_jobs": MAX_QUEUED_BATCH_JOBS,
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "completed": counts.get("completed", 0),
+        "failed": counts.get("failed", 0)
+    }
+
+
+
+def _scrape_queue_depth() -> int:
+    with _jobs_lock:
+        return _queued_count(batch=False) + _queued_count(batch=True)
+
+
+# Sampled whenever /metrics is scraped
+QUEUE_DEPTH.set_function(_scrape_queue_depth)
@@ -0,0 +1,63 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+
+# Stages run from sub-second (probing) to many minutes (long renders)
+_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 2400)
+
+STAGE_SECONDS = Histogram(
+    "render_stage_seconds",
+    "Time spent in each render pipeline stage",
+    ["stage"],
+    buckets=_BUCKETS
+)
+FFMPEG_SECONDS = Histogram(
+    "ffmpeg_invocation_seconds",
+    "Wall time of each ffmpeg/ffprobe invocation",
+    ["step"],
+    buckets=_BUCKETS
+)
+STAGE_FAILURES = Counter(
+    "render_stage_failures_total",
+    "Failures by pipeline stage",
+    ["stage"]
+)
+BACKGROUND_FRAMES = Counter(
+    "background_removal_frames_total",
+    "Avatar frames by whether they were color keyed, segmented by rembg or reused a previous mask",
+    ["result"]
+)
+RENDERS_IN_FLIGHT = Gauge(
+    "renders_in_flight",
+    "Render jobs currently running on a worker"
+)
+QUEUE_DEPTH = Gauge(
+    "render_queue_depth",
+    "Render jobs waiting for a worker"
+)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Time a pipeline stage and count it as failed if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage=stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def track_ffmpeg(step: str):
+    """Time one ffmpeg invocation and count it as an ffmpeg failure if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage=f"ffmpeg_{step}").inc()
+        raise
+    finally:
+        FFMPEG_SECONDS.labels(step=step).observe(time.perf_counter() - start)
@@ -0,0 +1,172 @@
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from utils.logging_setup import logger
+from config import PROFILE_DIR, PROFILE_TOP_FUNCTIONS, PROFILE_MAX_COUNT
+
+# The session for the render running in the current context, if profiled
+_current_session = contextvars.ContextVar("profile_session", default=None)
+_prune_lock = threading.Lock()
+
+
+class ProfileSession:
+    """Collects subprocess timings for one profiled request"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.subprocesses = []
+        self._lock = threading.Lock()
+
+    def record_subprocess(self, step: str, command: list[str], wall_seconds: float,
+                          user_cpu_seconds: float | None, system_cpu_seconds: float | None, returncode: int):
+        with self._lock:
+            self.subprocesses.append({
+                "step": step,
+                "command": " ".join(command)[:500],
+                "wall_seconds": round(wall_seconds, 4),
+                "user_cpu_seconds": None if user_cpu_seconds is None else round(user_cpu_seconds, 4),
+                "system_cpu_seconds": None if system_cpu_seconds is None else round(system_cpu_seconds, 4),
+                "returncode": returncode
+            })
+
+
+class RusagePopen(subprocess.Popen):
+    """Popen that keeps the child's resource usage when it is reaped"""
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, sts, self.rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            pid, sts = self.pid, 0
+        return pid, sts
+
+
+def current_session() -> ProfileSession | None:
+    return _current_session.get()
+
+
+def record_process(step: str, process: RusagePopen, wall_seconds: float):
+    """Record a finished RusagePopen child against the current profile session, if any"""
+    session = current_session()
+    if session is None:
+        return
+    rusage = process.rusage
+    session.record_subprocess(
+        step, process.args, wall_seconds,
+        rusage.ru_utime if rusage else None,
+        rusage.ru_stime if rusage else None,
+        process.returncode
+    )
+
+
+def run_profiled(session: ProfileSession, step: str, command: list[str], check: bool = False,
+                 capture_output: bool = False, **kwargs) -> subprocess.CompletedProcess:
+    """Equivalent of subprocess.run that records wall and CPU time of the child"""
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+
+    start = time.perf_counter()
+    with RusagePopen(command, **kwargs) as process:
+        stdout, stderr = process.communicate()
+    wall_seconds = time.perf_counter() - start
+
+    rusage = process.rusage
+    session.record_subprocess(
+        step, command, wall_seconds,
+        rusage.ru_utime if rusage else None,
+        rusage.ru_stime if rusage else None,
+        process.returncode
+    )
+
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+def _top_functions(profiler: cProfile.Profile) -> list[dict]:
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+    return [
+        {
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": calls,
+            "own_seconds": round(own_time, 4),
+            "cumulative_seconds": round(cumulative_time, 4)
+        }
+        for (filename, line, name), (_, calls, own_time, cumulative_time, _) in rows
+    ]
+
+
+@contextmanager
+def profile_request(request_id: str):
+    """Profile the Python side of a render in this thread and record its subprocesses.
+
+    Writes {request_id}.prof (cProfile data) and {request_id}.json (summary)
+    to PROFILE_DIR when the block exits.
+    """
+    session = ProfileSession(request_id)
+    token = _current_session.set(session)
+    profiler = cProfile.Profile()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    profiler.enable()
+    try:
+        yield session
+    finally:
+        profiler.disable()
+        wall_seconds = time.perf_counter() - wall_start
+        python_cpu_seconds = time.thread_time() - cpu_start
+        _current_session.reset(token)
+
+        try:
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{request_id}.prof"))
+            subprocess_wall = sum(p["wall_seconds"] for p in session.subprocesses)
+            subprocess_cpu = sum(
+                (p["user_cpu_seconds"] or 0) + (p["system_cpu_seconds"] or 0) for p in session.subprocesses
+            )
+            summary = {
+                "request_id": request_id,
+                "created_at": time.time(),
+                "wall_seconds": round(wall_seconds, 4),
+                "python_cpu_seconds": round(python_cpu_seconds, 4),
+                "subprocess_wall_seconds": round(subprocess_wall, 4),
+                "subprocess_cpu_seconds": round(subprocess_cpu, 4),
+                "subprocesses": session.subprocesses,
+                "top_functions": _top_functions(profiler)
+            }
+            with open(os.path.join(PROFILE_DIR, f"{request_id}.json"), "w") as f:
+                json.dump(summary, f, indent=2)
+            logger.info(f"Saved profile for request {request_id}")
+            _prune_profiles()
+        except Exception as e:
+            logger.error(f"Error saving profile for request {request_id}: {str(e)}")
+
+
+def _prune_profiles():
+    """Delete the oldest profiles beyond PROFILE_MAX_COUNT"""
+    with _prune_lock:
+        summaries = sorted(
+            (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith(".json")),
+            key=os.path.getmtime
+        )
+        for summary_path in summaries[:max(0, len(summaries) - PROFILE_MAX_COUNT)]:
+            for path in (summary_path, f"{os.path.splitext(summary_path)[0]}.prof"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def profile_path(request_id: str, extension: str) -> str | None:
+    """Return the path of a saved profile artifact, or None if it doesn't exist"""
+    if os.path.basename(request_id) != request_id or request_id.startswith("."):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{request_id}.{extension}")
+    return path if os.path.isfile(path) else None
+
@@ -0,0 +1,230 @@
+import abc
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.logging_setup import logger
+from services.google_drive import upload_to_drive, upload_stream_to_drive
+from config import (
+    STORAGE_BACKEND, STORAGE_LOCAL_DIR, PUBLIC_BASE_URL, S3_BUCKET, S3_ENDPOINT_URL, S3_REGION,
+    S3_KEY_PREFIX, S3_PUBLIC_BASE_URL, S3_PRESIGN_EXPIRY_SECONDS, S3_MULTIPART_CHUNK_SIZE,
+    S3_MULTIPART_CONCURRENCY, TEMP_DIR
+)
+
+
+class StorageBackend(abc.ABC):
+    """Destination for rendered videos.
+
+    upload() returns a dict with "shareable_link" and "download_link".
+    """
+    name = "base"
+
+    @abc.abstractmethod
+    def upload(self, file_path: str, mime_type: str = 'video/mp4') -> dict:
+        """Store the file at file_path and return its links"""
+
+    def upload_stream(self, chunks, filename: str, mime_type: str = 'video/mp4') -> dict:
+        """Store a file produced as an iterator of byte chunks.
+
+        Backends that can't consume a stream spool it to disk and upload the
+        finished file, so there is no overlap with encoding for them.
+        """
+        logger.warning(f"The {self.name} storage backend can't stream; spooling the upload to disk first")
+        fd, spool_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1], dir=TEMP_DIR)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            return self.upload(spool_path, mime_type)
+        finally:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+
+
+class DriveStorage(StorageBackend):
+    """Upload to Google Drive and share with anyone who has the link"""
+    name = "drive"
+
+    def upload(self, file_path: str, mime_type: str = 'video/mp4') -> dict:
+        return upload_to_drive(file_path, mime_type)
+
+    def upload_stream(self, chunks, filename: str, mime_type: str = 'video/mp4') -> dict:
+        return upload_stream_to_drive(chunks, filename, mime_type)
+
+
+class LocalStorage(StorageBackend):
+    """Keep results on local disk and serve them from /files/{file_id}"""
+    name = "local"
+
+    def __init__(self, root: str = STORAGE_LOCAL_DIR, base_url: str = PUBLIC_BASE_URL):
+        self.root = root
+        self.base_url = base_url
+        os.makedirs(root, exist_ok=True)
+
+    def upload(self, file_path: str, mime_type: str = 'video/mp4') -> dict:
+        ext = os.path.splitext(file_path)[1] or mimetypes.guess_extension(mime_type) or ""
+        file_id = f"{uuid.uuid4().hex}{ext}"
+        # Renders live in a workspace that is deleted afterwards, so moving is safe
+        shutil.move(file_path, os.path.join(self.root, file_id))
+        logger.info(f"Stored {file_id} in {self.root}")
+        return {
+            "shareable_link": f"{self.base_url}/files/{file_id}",
+            "download_link": f"{self.base_url}/files/{file_id}?download=1"
+        }
+
+    def upload_stream(self, chunks, filename: str, mime_type: str = 'video/mp4') -> dict:
+        file_id = f"{uuid.uuid4().hex}{os.path.splitext(filename)[1]}"
+        path = os.path.join(self.root, file_id)
+        try:
+            with open(path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        logger.info(f"Stored {file_id} in {self.root}")
+        return {
+            "shareable_link": f"{self.base_url}/files/{file_id}",
+            "download_link": f"{self.base_url}/files/{file_id}?download=1"
+        }
+
+    def resolve(self, file_id: str) -> str | None:
+        """Return the path for a stored file id, or None if it doesn't exist"""
+        if os.path.basename(file_id) != file_id or file_id.startswith("."):
+            return None
+        path = os.path.join(self.root, file_id)
+        return path if os.path.isfile(path) else None
+
+
+class S3Storage(StorageBackend):
+    """Upload to an S3-compatible bucket using parallel multipart uploads"""
+    name = "s3"
+
+    def __init__(self):
+        # boto3 is only needed when this backend is selected
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        if not S3_BUCKET:
+            raise ValueError("S3_BUCKET must be set to use the s3 storage backend")
+
+        # boto3 clients are thread-safe, so one is shared by every render worker
+        self.client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=S3_MULTIPART_CONCURRENCY,
+            use_threads=True
+        )
+
+    def upload(self, file_path: str, mime_type: str = 'video/mp4') -> dict:
+        key = f"{S3_KEY_PREFIX}{uuid.uuid4().hex}{os.path.splitext(file_path)[1]}"
+        file_size = os.path.getsize(file_path)
+
+        logger.info(f"Uploading file to s3://{S3_BUCKET}/{key}...")
+        start = time.perf_counter()
+        self.client.upload_file(
+            file_path, S3_BUCKET, key,
+            ExtraArgs={"ContentType": mime_type},
+            Config=self.transfer_config
+        )
+        elapsed = time.perf_counter() - start
+        logger.info(f"Uploaded {file_size} bytes in {elapsed:.2f}s")
+        return self._links(key)
+
+    def upload_stream(self, chunks, filename: str, mime_type: str = 'video/mp4') -> dict:
+        """Upload parts in parallel as soon as each fills, while the producer keeps writing"""
+        key = f"{S3_KEY_PREFIX}{uuid.uuid4().hex}{os.path.splitext(filename)[1]}"
+        upload_id = self.client.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, ContentType=mime_type
+        )["UploadId"]
+        # Cap parts held in memory at once so a slow network throttles the reader
+        in_flight = threading.Semaphore(S3_MULTIPART_CONCURRENCY * 2)
+
+        def upload_part(part_number: int, body: bytes) -> dict:
+            try:
+                response = self.client.upload_part(
+                    Bucket=S3_BUCKET, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body
+                )
+                return {"PartNumber": part_number, "ETag": response["ETag"]}
+            finally:
+                in_flight.release()
+
+        logger.info(f"Streaming upload to s3://{S3_BUCKET}/{key}...")
+        start = time.perf_counter()
+        futures = []
+        total = 0
+        try:
+            with ThreadPoolExecutor(max_workers=S3_MULTIPART_CONCURRENCY) as executor:
+                buffer = bytearray()
+                for chunk in chunks:
+                    buffer.extend(chunk)
+                    total += len(chunk)
+                    if len(buffer) >= S3_MULTIPART_CHUNK_SIZE:
+                        in_flight.acquire()
+                        futures.append(executor.submit(upload_part, len(futures) + 1, bytes(buffer)))
+                        buffer.clear()
+                # The last part may be smaller than the 5MB S3 minimum
+                if buffer or not futures:
+                    in_flight.acquire()
+                    futures.append(executor.submit(upload_part, len(futures) + 1, bytes(buffer)))
+                parts = [future.result() for future in futures]
+
+            self.client.complete_multipart_upload(
+                Bucket=S3_BUCKET, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id)
+            raise
+
+        elapsed = time.perf_counter() - start
+        logger.info(f"Streamed {total} bytes in {len(futures)} parts in {elapsed:.2f}s")
+        return self._links(key)
+
+    def _links(self, key: str) -> dict:
+        if S3_PUBLIC_BASE_URL:
+            url = f"{S3_PUBLIC_BASE_URL.rstrip('/')}/{key}"
+            return {"shareable_link": url, "download_link": url}
+
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": S3_BUCKET, "Key": key},
+            ExpiresIn=S3_PRESIGN_EXPIRY_SECONDS
+        )
+        download_url = self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": S3_BUCKET,
+                "Key": key,
+                "ResponseContentDisposition": f"attachment; filename={os.path.basename(key)}"
+            },
+            ExpiresIn=S3_PRESIGN_EXPIRY_SECONDS
+        )
+        return {"shareable_link": url, "download_link": download_url}
+
+
+_BACKENDS = {
+    DriveStorage.name: DriveStorage,
+    LocalStorage.name: LocalStorage,
+    S3Storage.name: S3Storage
+}
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """Return the configured storage backend, creating it on first use"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            backend = _BACKENDS.get(STORAGE_BACKEND)
+            if backend is None:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+            _storage = backend()
+            logger.info(f"Using {_storage.name} storage backend")
+        return _storage
@@ -0,0 +1,141 @@
+import re
+import wave
+import numpy as np
+from utils.logging_setup import logger
+from config import SUBTITLE_MAX_WORDS
+
+# Energy is measured over 20 ms windows; pauses shorter than MIN_PAUSE are
+# treated as part of the speech around them
+_WINDOW_SECONDS = 0.02
+_MIN_PAUSE_SECONDS = 0.3
+# Cue boundaries this close to a pause (in speech time) move onto it
+_SNAP_SECONDS = 0.75
+_SENTENCE_END = re.compile(r"[.!?;:]['\")\]]*$")
+
+
+def split_cues(text: str, max_words: int = SUBTITLE_MAX_WORDS) -> list[list[str]]:
+    """Split a script into cues of at most max_words words, breaking after sentence punctuation"""
+    cues = []
+    cue = []
+    for word in text.split():
+        cue.append(word)
+        if len(cue) >= max_words or _SENTENCE_END.search(word):
+            cues.append(cue)
+            cue = []
+    if cue:
+        cues.append(cue)
+    return cues
+
+
+def speech_regions(audio_path: str) -> tuple[list[tuple[float, float]], float]:
+    """Find speech in a 16-bit PCM WAV from its short-time energy.
+
+    Returns the (start, end) seconds of each speech region and the total duration.
+    """
+    with wave.open(audio_path, "rb") as wav:
+        rate = wav.getframerate()
+        channels = wav.getnchannels()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+
+    samples = samples.reshape(-1, channels).astype(np.float32).mean(axis=1)
+    duration = len(samples) / rate
+    window = max(1, int(rate * _WINDOW_SECONDS))
+    count = len(samples) // window
+    if count == 0:
+        return [(0.0, duration)], duration
+
+    rms = np.sqrt((samples[:count * window].reshape(count, window) ** 2).mean(axis=1))
+    floor, peak = np.percentile(rms, 10), np.percentile(rms, 99)
+    if peak <= floor:
+        return [(0.0, duration)], duration
+    voiced = rms > floor + (peak - floor) * 0.1
+
+    regions = []
+    start = None
+    for i, is_voiced in enumerate(np.append(voiced, False)):
+        if is_voiced and start is None:
+            start = i * _WINDOW_SECONDS
+        elif not is_voiced and start is not None:
+            end = i * _WINDOW_SECONDS
+            if regions and start - regions[-1][1] < _MIN_PAUSE_SECONDS:
+                regions[-1] = (regions[-1][0], end)
+            else:
+                regions.append((start, end))
+            start = None
+
+    return regions or [(0.0, duration)], duration
+
+
+def _speech_to_wall(regions: list[tuple[float, float]], t: float, at_end: bool) -> float:
+    """Map a position on the concatenated speech timeline back to audio time.
+
+    A position on a boundary between regions maps to the end of the earlier
+    region for cue ends and to the start of the later one for cue starts.
+    """
+    elapsed = 0.0
+    for start, end in regions:
+        length = end - start
+        if t < elapsed + length or (at_end and t <= elapsed + length):
+            return start + (t - elapsed)
+        elapsed += length
+    return regions[-1][1]
+
+
+def align_script(text: str, audio_path: str) -> list[dict]:
+    """Time script cues against the speech in a WAV without speech recognition.
+
+    Words are spread over the detected speech in proportion to their length,
+    skipping the pauses between regions, and cue boundaries near a pause are
+    moved onto it, so cues start and end with the speech they belong to.
+    Returns Whisper-style segments.
+    """
+    cues = split_cues(text)
+    if not cues:
+        return []
+
+    regions, _ = speech_regions(audio_path)
+    speech_seconds = sum(end - start for start, end in regions)
+    weights = [sum(len(word) + 1 for word in cue) for cue in cues]
+    total_weight = sum(weights)
+
+    # Pauses as positions on the speech timeline
+    pauses = []
+    elapsed = 0.0
+    for start, end in regions[:-1]:
+        elapsed += end - start
+        pauses.append(elapsed)
+
+    boundaries = [0.0]
+    position = 0
+    for weight in weights[:-1]:
+        position += weight
+        boundary = speech_seconds * position / total_weight
+        # Only pauses after the previous boundary are free; snapping two
+        # boundaries onto one pause would leave the cue between them empty
+        nearest = min(
+            (pause for pause in pauses if pause > boundaries[-1]),
+            key=lambda pause: abs(pause - boundary), default=None
+        )
+        if nearest is not None and abs(nearest - boundary) <= _SNAP_SECONDS:
+            boundary = nearest
+        boundaries.append(max(boundary, boundaries[-1]))
+    boundaries.append(speech_seconds)
+
+    segments = []
+    for i, cue in enumerate(cues):
+        text = " ".join(cue)
+        # A cue squeezed to no speech time joins its neighbour rather than
+        # getting an end before its start
+        if boundaries[i + 1] <= boundaries[i] and (segments or i + 1 < len(cues)):
+            if segments:
+                segments[-1]["text"] += f" {text}"
+            else:
+                boundaries[i + 1] = boundaries[i]
+                cues[i + 1] = cue + cues[i + 1]
+            continue
+        start = _speech_to_wall(regions, boundaries[i], at_end=False)
+        end = _speech_to_wall(regions, boundaries[i + 1], at_end=True)
+        segments.append({"start": start, "end": end, "text": text})
+
+    logger.info(f"Aligned {len(segments)} subtitle cues to {len(regions)} speech regions")
+    return segments
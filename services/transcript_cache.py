@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from utils.logging_setup import logger
+from config import TRANSCRIPT_CACHE_DIR, TRANSCRIPT_CACHE_MAX_BYTES
+
+# Whisper segments persisted as one JSON file per
+# (audio content hash, model size, language) key
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def audio_hash(audio_path: str) -> str:
+    """Hash the audio file contents"""
+    hasher = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _entry_path(content_hash: str, model_size: str, language: str | None) -> str:
+    return os.path.join(TRANSCRIPT_CACHE_DIR, f"{content_hash}_{model_size}_{language or 'auto'}.json")
+
+
+def _list_entries() -> list[str]:
+    return [
+        os.path.join(TRANSCRIPT_CACHE_DIR, name) for name in os.listdir(TRANSCRIPT_CACHE_DIR)
+        if name.endswith(".json")
+    ]
+
+
+def get_transcript(content_hash: str, model_size: str, language: str | None) -> list[dict] | None:
+    """Return cached segments for the key, or None on a miss"""
+    path = _entry_path(content_hash, model_size, language)
+    try:
+        with open(path, encoding="utf-8") as f:
+            segments = json.load(f)["segments"]
+    except FileNotFoundError:
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    except Exception as e:
+        logger.error(f"Error reading cached transcript {path}: {str(e)}")
+        with _lock:
+            _stats["misses"] += 1
+        return None
+
+    with _lock:
+        _stats["hits"] += 1
+        # Refresh the access time so eviction keeps recently used transcripts
+        if os.path.exists(path):
+            os.utime(path)
+    return segments
+
+
+def store_transcript(content_hash: str, model_size: str, language: str | None, segments: list[dict]):
+    """Persist segments for the key and evict old entries beyond the byte budget"""
+    path = _entry_path(content_hash, model_size, language)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    entry = {
+        "audio_hash": content_hash,
+        "model_size": model_size,
+        "language": language,
+        "segments": [
+            {"start": seg["start"], "end": seg["end"], "text": seg["text"]}
+            for seg in segments
+        ]
+    }
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error(f"Error caching transcript {path}: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    with _lock:
+        _stats["stores"] += 1
+        _evict()
+
+
+def _evict():
+    """Remove least recently used transcripts until the cache fits its budget"""
+    entries = sorted(_list_entries(), key=os.path.getatime)
+    total = sum(os.path.getsize(path) for path in entries)
+    for path in entries:
+        if total <= TRANSCRIPT_CACHE_MAX_BYTES:
+            break
+        total -= os.path.getsize(path)
+        os.remove(path)
+        _stats["evictions"] += 1
+
+
+def get_transcript_cache_stats() -> dict:
+    """Report cache usage, counters and the cached keys"""
+    with _lock:
+        entries = _list_entries()
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "entries": len(entries),
+            "bytes": sum(os.path.getsize(path) for path in entries),
+            "max_bytes": TRANSCRIPT_CACHE_MAX_BYTES,
+            "hit_ratio": round(_stats["hits"] / lookups, 3) if lookups else None,
+            **_stats,
+            "keys": sorted(os.path.basename(path)[:-len(".json")] for path in entries)
+        }
+
+
+def clear_transcript_cache() -> int:
+    """Delete every cached transcript and return how many were removed"""
+    with _lock:
+        entries = _list_entries()
+        for path in entries:
+            os.remove(path)
+    return len(entries)
+
+
+os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
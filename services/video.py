@@ -1,71 +1,309 @@
-import whisper
+import contextvars
 import subprocess
+import hashlib
+import json
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from utils.logging_setup import logger
+from services.whisper_models import transcribe_audio
+from services.metrics import track_stage, FFMPEG_SECONDS
+from services.profiling import RusagePopen, record_process
+from utils.ffmpeg import run_ffmpeg, ffmpeg_output
+from config import (
+    OUTPUT_WIDTH, OUTPUT_HEIGHT, OUTPUT_FPS, OUTPUT_VIDEO_TIMESCALE,
+    OUTPUT_AUDIO_SAMPLE_RATE, OUTPUT_AUDIO_CHANNELS, PREFIX_CACHE_DIR, PREFIX_CACHE_MAX_BYTES,
+    STREAM_CHUNK_SIZE, STILL_IMAGE_MODE, STILL_IMAGE_SAMPLE_FPS, STILL_IMAGE_GOP_SECONDS,
+    SEGMENT_PARALLEL_WORKERS, SEGMENT_PARALLEL_MIN_SECONDS
+)
 import os
 
-def create_video(image_path: str, audio_path: str, video_path: str) -> float:
-    """Create video from image and audio, hard-burn subtitles using ffmpeg and Whisper Tiny"""
-    try:
-        logger.info("Loading Whisper Tiny model...")
-        model = whisper.load_model("tiny")
+def write_srt(segments: list[dict], srt_path: str):
+    """Write Whisper-style segments to an SRT file"""
+    with open(srt_path, "w", encoding="utf-8") as srt_file:
+        for i, seg in enumerate(segments, start=1):
+            start = format_timestamp(seg['start'])
+            end = format_timestamp(seg['end'])
+            text = seg['text'].strip()
+            srt_file.write(f"{i}\n{start} --> {end}\n{text}\n\n")
+
 
-        logger.info("Transcribing audio...")
-        result = model.transcribe(audio_path, verbose=False)
-        segments = result['segments']
+def prepare_subtitles(audio_path: str, workspace: str) -> tuple[str, float, list[dict]]:
+    """Transcribe audio into an SRT file in workspace; return its path, the audio duration and the segments"""
+    segments = transcribe_audio(audio_path)
 
-        # Load audio to get duration
-        from moviepy import AudioFileClip
+    # Load audio to get duration
+    from moviepy import AudioFileClip
+    with track_stage("duration_probe"):
         audio_clip = AudioFileClip(audio_path)
         duration = audio_clip.duration
+        audio_clip.close()
 
-        # Create temporary subtitle file
-        srt_path = "temp_subtitles.srt"
-        with open(srt_path, "w", encoding="utf-8") as srt_file:
-            for i, seg in enumerate(segments, start=1):
-                start = format_timestamp(seg['start'])
-                end = format_timestamp(seg['end'])
-                text = seg['text'].strip()
-                srt_file.write(f"{i}\n{start} --> {end}\n{text}\n\n")
-
-        # Create a temporary video from image and audio
-        logger.info("Creating temporary video...")
-        temp_video = "temp_video.mp4"
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-loop", "1",
-            "-i", image_path,
-            "-i", audio_path,
-            "-shortest",
+    # Create temporary subtitle file
+    srt_path = os.path.join(workspace, "subtitles.srt")
+    write_srt(segments, srt_path)
+
+    return srt_path, duration, segments
+
+
+def prescale_image(image_path: str, workspace: str) -> str:
+    """Scale the background image to the output size once, instead of on every frame"""
+    scaled_path = os.path.join(workspace, "still.png")
+    run_ffmpeg("prescale", [
+        "ffmpeg", "-y",
+        "-i", image_path,
+        "-vf", f"scale={OUTPUT_WIDTH}:{OUTPUT_HEIGHT},format=rgb24",
+        "-frames:v", "1",
+        scaled_path
+    ], check=True)
+    return scaled_path
+
+
+def subtitle_change_times(segments: list[dict], duration: float) -> list[float]:
+    """Return the sorted times at which the burned-in caption changes.
+
+    The last still-image sample before duration is always included, so the
+    video track runs to the end of the audio.
+    """
+    last_sample = max(0, math.ceil(duration * STILL_IMAGE_SAMPLE_FPS - 1e-6) - 1) / STILL_IMAGE_SAMPLE_FPS
+    times = {0.0, round(last_sample, 3)}
+    for seg in segments:
+        times.add(round(seg['start'], 3))
+        times.add(round(seg['end'], 3))
+    return sorted(t for t in times if t <= last_sample)
+
+
+def _video_filter(srt_path: str, watermark_input: int, keyframe_times: list[float] | None) -> str:
+    """Filter graph that burns subtitles and overlays the watermark onto input 0.
+
+    With keyframe_times (still-image mode) only the samples where the
+    caption changes are kept, plus one per GOP so seeking still works and
+    the sample at the last change time, which holds the track to the end.
+    """
+    if keyframe_times is not None:
+        # The still is already at the output size, and the picture only
+        # changes with the captions, so no frame comparison is needed
+        gop_frames = STILL_IMAGE_SAMPLE_FPS * STILL_IMAGE_GOP_SECONDS
+        keep = sorted({math.ceil(t * STILL_IMAGE_SAMPLE_FPS - 1e-6) for t in keyframe_times})
+        expression = "+".join([f"not(mod(n,{gop_frames}))", *(f"eq(n,{n})" for n in keep)])
+        return (
+            f"[0:v]subtitles={srt_path}[sub];[{watermark_input}:v]scale=iw*0.15:-1[watermark];"
+            f"[sub][watermark]overlay=10:H-h-10,select='{expression}',format=yuv420p[v]"
+        )
+    # Scale the watermark to 15% of its original size and position it in the bottom left
+    return (
+        f"[0:v]scale={OUTPUT_WIDTH}:{OUTPUT_HEIGHT},subtitles={srt_path}[sub];"
+        f"[{watermark_input}:v]scale=iw*0.15:-1[watermark];"
+        f"[sub][watermark]overlay=10:H-h-10,format=yuv420p[v]"
+    )
+
+
+def _image_input_args(image_path: str, still_image: bool) -> list[str]:
+    if still_image:
+        # Sample the still at a low rate instead of OUTPUT_FPS
+        return ["-loop", "1", "-framerate", str(STILL_IMAGE_SAMPLE_FPS), "-i", image_path]
+    return ["-loop", "1", "-i", image_path]
+
+
+def _video_encode_args(keyframe_times: list[float] | None) -> list[str]:
+    if keyframe_times is not None:
+        return [
+            "-fps_mode", "vfr",
+            "-g", str(STILL_IMAGE_SAMPLE_FPS * STILL_IMAGE_GOP_SECONDS),
+            "-force_key_frames", ",".join(f"{t:.3f}" for t in keyframe_times),
             "-c:v", "libx264",
             "-tune", "stillimage",
-            "-pix_fmt", "yuv420p",
-            "-c:a", "aac",
-            "-b:a", "192k",
-            "-vf", "scale=1280:720",
-            temp_video
-        ], check=True)
+            "-pix_fmt", "yuv420p"
+        ]
+    return [
+        "-r", str(OUTPUT_FPS),
+        "-c:v", "libx264",
+        "-tune", "stillimage",
+        "-pix_fmt", "yuv420p"
+    ]
 
-        # Path to watermark image
-        watermark_path = "watermark.png"
-        
-        # Burn subtitles and add watermark to the video
-        logger.info("Burning subtitles and adding watermark...")
-        subprocess.run([
+
+def _audio_encode_args() -> list[str]:
+    return [
+        "-c:a", "aac",
+        "-b:a", "192k",
+        "-ar", str(OUTPUT_AUDIO_SAMPLE_RATE),
+        "-ac", str(OUTPUT_AUDIO_CHANNELS)
+    ]
+
+
+def build_render_command(image_path: str, audio_path: str, srt_path: str, output: str,
+                         keyframe_times: list[float] | None = None) -> list[str]:
+    """Build the single-pass ffmpeg command that renders image, audio, subtitles and watermark.
+
+    Pass output="pipe:1" to get a fragmented MP4 on stdout that can be
+    consumed while ffmpeg is still encoding. Passing keyframe_times selects
+    still-image mode: image_path must already be at the output size, only
+    frames where the picture changes are encoded (variable frame rate), and
+    keyframes are forced at the given caption change times. Build them with
+    subtitle_change_times so the video track covers the full duration.
+    """
+    # Path to watermark image
+    watermark_path = "watermark.png"
+    still_image = keyframe_times is not None
+
+    command = [
+        "ffmpeg", "-y",
+        *_image_input_args(image_path, still_image),
+        "-i", audio_path,
+        "-i", watermark_path,
+        "-filter_complex", _video_filter(srt_path, 2, keyframe_times),
+        "-map", "[v]",
+        "-map", "1:a",
+        "-shortest",
+        *_video_encode_args(keyframe_times),
+        *_audio_encode_args(),
+        "-video_track_timescale", str(OUTPUT_VIDEO_TIMESCALE)
+    ]
+    if output == "pipe:1":
+        # A regular MP4 needs a seek back to write the moov atom; fragments don't
+        command += ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4"]
+    command.append(output)
+    return command
+
+
+def _render_inputs(image_path: str, audio_path: str, workspace: str) -> tuple[str, str, float, list[dict]]:
+    """Prepare subtitles and, in still-image mode, the pre-scaled image"""
+    srt_path, duration, segments = prepare_subtitles(audio_path, workspace)
+    if STILL_IMAGE_MODE:
+        image_path = prescale_image(image_path, workspace)
+    return image_path, srt_path, duration, segments
+
+
+def choose_split_points(segments: list[dict], duration: float, chunks: int) -> list[float]:
+    """Pick chunk boundaries in the gaps between segments, near equal divisions of the timeline.
+
+    Returns the boundaries including 0 and duration.
+    """
+    # Candidate cut points: the middle of every gap between consecutive segments
+    candidates = [
+        (segments[i]['end'] + segments[i + 1]['start']) / 2
+        for i in range(len(segments) - 1)
+        if segments[i + 1]['start'] >= segments[i]['end']
+    ]
+    min_chunk = duration / chunks / 2
+    points = [0.0]
+    for k in range(1, chunks):
+        target = duration * k / chunks
+        usable = [t for t in candidates if points[-1] + min_chunk <= t <= duration - min_chunk]
+        if not usable:
+            continue
+        point = min(usable, key=lambda t: abs(t - target))
+        # Align to a frame boundary so the chunks join without gaps
+        point = round(point * OUTPUT_FPS) / OUTPUT_FPS
+        if point > points[-1]:
+            points.append(point)
+    points.append(duration)
+    return points
+
+
+def slice_segments(segments: list[dict], start: float, end: float) -> list[dict]:
+    """Return the segments overlapping [start, end), shifted to start at zero"""
+    return [
+        {
+            "start": max(seg['start'], start) - start,
+            "end": min(seg['end'], end) - start,
+            "text": seg['text']
+        }
+        for seg in segments
+        if seg['end'] > start and seg['start'] < end
+    ]
+
+
+def _render_segment_parallel(image_path: str, audio_path: str, video_path: str, workspace: str,
+                             segments: list[dict], duration: float):
+    """Encode the video in chunks on parallel ffmpeg processes and join them with a stream copy.
+
+    Chunks are video-only; the narration is encoded once while joining, so
+    there are no AAC priming gaps at the chunk boundaries.
+    """
+    points = choose_split_points(segments, duration, SEGMENT_PARALLEL_WORKERS)
+    still_image = STILL_IMAGE_MODE
+    threads_per_chunk = max(1, (os.cpu_count() or 1) // (len(points) - 1))
+    logger.info(f"Rendering {len(points) - 1} chunks in parallel at {points}")
+
+    def render_chunk(index: int) -> str:
+        start, end = points[index], points[index + 1]
+        chunk_segments = slice_segments(segments, start, end)
+        srt_path = os.path.join(workspace, f"chunk_{index:03d}.srt")
+        write_srt(chunk_segments, srt_path)
+        chunk_path = os.path.join(workspace, f"chunk_{index:03d}.mp4")
+        keyframe_times = subtitle_change_times(chunk_segments, end - start) if still_image else None
+        run_ffmpeg("chunk", [
             "ffmpeg", "-y",
-            "-i", temp_video,
-            "-i", watermark_path,
-            "-filter_complex", 
-            # Scale the watermark to 15% of its original size and position it in the bottom left
-            f"subtitles={srt_path}[sub];[1:v]scale=iw*0.15:-1[watermark];[sub][watermark]overlay=10:H-h-10[v]",
-            "-map", "[v]", 
-            "-map", "0:a",
-            "-c:a", "copy",
-            video_path
+            *_image_input_args(image_path, still_image),
+            "-i", "watermark.png",
+            "-filter_complex", _video_filter(srt_path, 1, keyframe_times),
+            "-map", "[v]",
+            "-t", f"{end - start:.3f}",
+            *_video_encode_args(keyframe_times),
+            "-threads", str(threads_per_chunk),
+            "-video_track_timescale", str(OUTPUT_VIDEO_TIMESCALE),
+            chunk_path
         ], check=True)
+        return chunk_path
+
+    with ThreadPoolExecutor(max_workers=len(points) - 1, thread_name_prefix="chunk") as executor:
+        # Copy the context so chunk encodes are recorded in the request's profile
+        futures = [
+            executor.submit(contextvars.copy_context().run, render_chunk, index)
+            for index in range(len(points) - 1)
+        ]
+        chunk_paths = [future.result() for future in futures]
+
+    # Give every chunk its planned length: a still-image chunk's last frame
+    # can end before its slice of the timeline, and the next chunk must not
+    # start early
+    concat_list_path = os.path.join(workspace, "chunks.txt")
+    with open(concat_list_path, "w") as f:
+        for index, chunk_path in enumerate(chunk_paths):
+            f.write(f"file '{os.path.abspath(chunk_path)}'\n")
+            f.write(f"duration {points[index + 1] - points[index]:.3f}\n")
+
+    logger.info("Joining chunks and muxing audio...")
+    run_ffmpeg("chunk_join", [
+        "ffmpeg", "-y",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", concat_list_path,
+        "-i", audio_path,
+        "-map", "0:v",
+        "-map", "1:a",
+        "-c:v", "copy",
+        *_audio_encode_args(),
+        "-video_track_timescale", str(OUTPUT_VIDEO_TIMESCALE),
+        video_path
+    ], check=True)
+
+
+def create_video(image_path: str, audio_path: str, video_path: str, workspace: str | None = None) -> float:
+    """Create video from image and audio, hard-burn subtitles using ffmpeg and Whisper.
+
+    Intermediate files go to workspace (defaults to the output's directory).
+    """
+    workspace = workspace or os.path.dirname(os.path.abspath(video_path))
+    try:
+        render_image, srt_path, duration, segments = _render_inputs(image_path, audio_path, workspace)
+
+        if SEGMENT_PARALLEL_WORKERS > 1 and duration >= SEGMENT_PARALLEL_MIN_SECONDS and len(segments) > 1:
+            _render_segment_parallel(render_image, audio_path, video_path, workspace, segments, duration)
+        else:
+            # Scale the image, burn subtitles and add the watermark in a single encode
+            logger.info("Rendering video with subtitles and watermark...")
+            keyframe_times = subtitle_change_times(segments, duration) if STILL_IMAGE_MODE else None
+            run_ffmpeg("render",
+                build_render_command(render_image, audio_path, srt_path, video_path, keyframe_times),
+                check=True
+            )
 
         # Cleanup
-        os.remove(temp_video)
         os.remove(srt_path)
 
         return duration
@@ -75,6 +313,54 @@ def create_video(image_path: str, audio_path: str, video_path: str) -> float:
         raise HTTPException(status_code=500, detail=f"Error creating video: {str(e)}")
 
 
+def create_video_streaming(image_path: str, audio_path: str, workspace: str, sink) -> tuple[float, dict]:
+    """Render like create_video, but hand fragmented MP4 bytes to sink while encoding.
+
+    sink receives an iterator of byte chunks and returns the storage links.
+    The iterator raises if ffmpeg fails, so the sink can abort its upload.
+    Returns the audio duration and whatever sink returned.
+    """
+    try:
+        render_image, srt_path, duration, segments = _render_inputs(image_path, audio_path, workspace)
+        keyframe_times = subtitle_change_times(segments, duration) if STILL_IMAGE_MODE else None
+
+        logger.info("Rendering video and streaming it to storage...")
+        started = time.perf_counter()
+        process = RusagePopen(
+            build_render_command(render_image, audio_path, srt_path, "pipe:1", keyframe_times),
+            stdout=subprocess.PIPE
+        )
+
+        def chunks():
+            while True:
+                chunk = process.stdout.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, "ffmpeg")
+
+        try:
+            # Encoding and uploading overlap here, so this is timed as its
+            # own stage rather than as part of the upload histogram
+            with track_stage("render_upload"):
+                result = sink(chunks())
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            os.remove(srt_path)
+            FFMPEG_SECONDS.labels(step="render_stream").observe(time.perf_counter() - started)
+            record_process("render_stream", process, time.perf_counter() - started)
+
+        return duration, result
+
+    except Exception as e:
+        logger.error(f"Error creating video: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error creating video: {str(e)}")
+
+
 def format_timestamp(seconds: float) -> str:
     """Convert seconds to SRT timestamp format."""
     hrs = int(seconds // 3600)
@@ -84,18 +370,133 @@ def format_timestamp(seconds: float) -> str:
     return f"{hrs:02}:{mins:02}:{secs:02},{millis:03}"
 
 
-def concat_videos(prefix_path: str, main_path: str, output_path: str):
-    """Concatenate two videos using ffmpeg"""
+def probe_video(path: str) -> dict:
+    """Probe the first video and audio stream of a file with ffprobe"""
+    output = ffmpeg_output("probe", [
+        "ffprobe", "-v", "error",
+        "-show_entries",
+        "stream=codec_type,codec_name,profile,width,height,pix_fmt,r_frame_rate,time_base,sample_rate,channels",
+        "-of", "json",
+        path
+    ])
+    streams = json.loads(output).get("streams", [])
+    video = next((st for st in streams if st.get("codec_type") == "video"), None)
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+    return {"video": video, "audio": audio}
+
+
+def matches_output_profile(probe: dict) -> bool:
+    """Check whether a probed file can be stream-copied next to a rendered video"""
+    video, audio = probe["video"], probe["audio"]
+    if not video or not audio:
+        return False
+    # Frame rate isn't compared: MP4 carries per-frame timestamps, and
+    # still-image renders are variable frame rate anyway
+    return (
+        video.get("codec_name") == "h264"
+        and video.get("profile") == "High"
+        and video.get("width") == OUTPUT_WIDTH
+        and video.get("height") == OUTPUT_HEIGHT
+        and video.get("pix_fmt") == "yuv420p"
+        and video.get("time_base") == f"1/{OUTPUT_VIDEO_TIMESCALE}"
+        and audio.get("codec_name") == "aac"
+        and audio.get("sample_rate") == str(OUTPUT_AUDIO_SAMPLE_RATE)
+        and audio.get("channels") == OUTPUT_AUDIO_CHANNELS
+    )
+
+
+def _file_hash(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _evict_prefix_cache():
+    """Remove the least recently used normalized prefixes beyond the byte budget"""
+    entries = [
+        os.path.join(PREFIX_CACHE_DIR, name) for name in os.listdir(PREFIX_CACHE_DIR)
+        if name.endswith(".mp4")
+    ]
+    entries.sort(key=os.path.getatime)
+    total = sum(os.path.getsize(path) for path in entries)
+    for path in entries:
+        if total <= PREFIX_CACHE_MAX_BYTES:
+            break
+        total -= os.path.getsize(path)
+        os.remove(path)
+        logger.info(f"Evicted normalized prefix: {path}")
+
+
+def normalize_prefix(prefix_path: str) -> str:
+    """Return a version of the prefix video in the output profile.
+
+    Prefixes already in the profile are used as-is. Others are transcoded
+    once and cached by content hash, so repeats only cost a lookup.
+    """
+    probe = probe_video(prefix_path)
+    if matches_output_profile(probe):
+        return prefix_path
+
+    profile_key = f"{OUTPUT_WIDTH}x{OUTPUT_HEIGHT}_{OUTPUT_FPS}_{OUTPUT_AUDIO_SAMPLE_RATE}_{OUTPUT_AUDIO_CHANNELS}"
+    cached_path = os.path.join(PREFIX_CACHE_DIR, f"{_file_hash(prefix_path)}_{profile_key}.mp4")
+    if os.path.exists(cached_path):
+        logger.info(f"Using cached normalized prefix: {cached_path}")
+        os.utime(cached_path)
+        return cached_path
+
+    logger.info("Normalizing prefix video to the output profile...")
+    # Write under a unique name so concurrent renders of the same prefix don't collide
+    tmp_path = os.path.join(PREFIX_CACHE_DIR, f"tmp_{uuid.uuid4().hex}.mp4")
+    command = ["ffmpeg", "-y", "-i", prefix_path]
+    if probe["audio"]:
+        audio_map = "0:a:0"
+    else:
+        # Add a silent track so the prefix has the same stream layout as the main video
+        command += ["-f", "lavfi", "-i", f"anullsrc=r={OUTPUT_AUDIO_SAMPLE_RATE}:cl=stereo"]
+        audio_map = "1:a"
+    command += [
+        "-vf",
+        f"scale={OUTPUT_WIDTH}:{OUTPUT_HEIGHT}:force_original_aspect_ratio=decrease,"
+        f"pad={OUTPUT_WIDTH}:{OUTPUT_HEIGHT}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={OUTPUT_FPS},format=yuv420p",
+        "-map", "0:v:0",
+        "-map", audio_map,
+        "-shortest",
+        "-c:v", "libx264",
+        "-profile:v", "high",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        "-b:a", "192k",
+        "-ar", str(OUTPUT_AUDIO_SAMPLE_RATE),
+        "-ac", str(OUTPUT_AUDIO_CHANNELS),
+        "-video_track_timescale", str(OUTPUT_VIDEO_TIMESCALE),
+        tmp_path
+    ]
     try:
-        # Create a temporary file list for ffmpeg concat
-        concat_list_path = "concat_list.txt"
-        with open(concat_list_path, "w") as f:
-            f.write(f"file '{os.path.abspath(prefix_path)}'\n")
-            f.write(f"file '{os.path.abspath(main_path)}'\n")
-        
-        # Concatenate videos
-        logger.info("Concatenating prefix and main video...")
-        subprocess.run([
+        run_ffmpeg("normalize_prefix", command, check=True)
+        os.replace(tmp_path, cached_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    try:
+        _evict_prefix_cache()
+    except OSError as e:
+        logger.error(f"Error evicting prefix cache: {str(e)}")
+    return cached_path
+
+
+def _concat_copy(prefix_path: str, main_path: str, output_path: str):
+    """Join two profile-matched videos with the concat demuxer and a stream copy"""
+    # Create a temporary file list for ffmpeg concat next to the output
+    concat_list_path = f"{output_path}.concat.txt"
+    with open(concat_list_path, "w") as f:
+        f.write(f"file '{os.path.abspath(prefix_path)}'\n")
+        f.write(f"file '{os.path.abspath(main_path)}'\n")
+
+    try:
+        run_ffmpeg("concat_copy", [
             "ffmpeg", "-y",
             "-f", "concat",
             "-safe", "0",
@@ -103,10 +504,54 @@ def concat_videos(prefix_path: str, main_path: str, output_path: str):
             "-c", "copy",
             output_path
         ], check=True)
-        
-        # Cleanup
+    finally:
         os.remove(concat_list_path)
+
+
+def _concat_filter(prefix_path: str, main_path: str, output_path: str):
+    """Join two mismatched videos by decoding both through the concat filter"""
+    scale = (
+        f"scale={OUTPUT_WIDTH}:{OUTPUT_HEIGHT}:force_original_aspect_ratio=decrease,"
+        f"pad={OUTPUT_WIDTH}:{OUTPUT_HEIGHT}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={OUTPUT_FPS},format=yuv420p"
+    )
+    audio = f"aresample={OUTPUT_AUDIO_SAMPLE_RATE},aformat=channel_layouts=stereo"
+    run_ffmpeg("concat_filter", [
+        "ffmpeg", "-y",
+        "-i", prefix_path,
+        "-i", main_path,
+        "-filter_complex",
+        f"[0:v]{scale}[v0];[0:a]{audio}[a0];[1:v]{scale}[v1];[1:a]{audio}[a1];"
+        f"[v0][a0][v1][a1]concat=n=2:v=1:a=1[v][a]",
+        "-map", "[v]",
+        "-map", "[a]",
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        "-b:a", "192k",
+        output_path
+    ], check=True)
+
+
+@track_stage("concat")
+def concat_videos(prefix_path: str, main_path: str, output_path: str):
+    """Concatenate two videos, stream-copying whenever both match the output profile"""
+    try:
+        normalized_prefix = prefix_path
+        try:
+            normalized_prefix = normalize_prefix(prefix_path)
+        except Exception as e:
+            logger.error(f"Error normalizing prefix video, falling back to filter concat: {str(e)}")
+
+        prefix_ok = matches_output_profile(probe_video(normalized_prefix))
+        main_ok = matches_output_profile(probe_video(main_path))
+
+        if prefix_ok and main_ok:
+            logger.info("Concatenating prefix and main video with stream copy...")
+            _concat_copy(normalized_prefix, main_path, output_path)
+        else:
+            logger.info("Concatenating prefix and main video with concat filter...")
+            _concat_filter(normalized_prefix, main_path, output_path)
         
     except Exception as e:
         logger.error(f"Error concatenating videos: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error concatenating videos: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error concatenating videos: {str(e)}")
@@ -0,0 +1,95 @@
+import threading
+import time
+import whisper
+from utils.logging_setup import logger
+from services.metrics import track_stage
+from services.transcript_cache import audio_hash, get_transcript, store_transcript
+from config import WHISPER_MODEL_SIZE, WHISPER_PRELOAD_MODELS, WHISPER_LANGUAGE
+
+# Process-wide registry of loaded Whisper models, keyed by model size
+_models = {}
+_model_locks = {}
+_model_stats = {}
+_registry_lock = threading.Lock()
+
+
+def get_whisper_model(model_size: str = WHISPER_MODEL_SIZE):
+    """Return the shared Whisper model for a size, loading it on first use"""
+    model = _models.get(model_size)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        # Another thread may have loaded it while we were waiting
+        model = _models.get(model_size)
+        if model is not None:
+            return model
+
+        logger.info(f"Loading Whisper {model_size} model...")
+        start = time.perf_counter()
+        model = whisper.load_model(model_size)
+        load_seconds = time.perf_counter() - start
+
+        resident_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+        resident_bytes += sum(b.numel() * b.element_size() for b in model.buffers())
+
+        _model_locks.setdefault(model_size, threading.Lock())
+        _model_stats[model_size] = {
+            "load_seconds": round(load_seconds, 3),
+            "resident_bytes": resident_bytes,
+            "device": str(model.device),
+            "loaded_at": time.time(),
+            "transcriptions": 0
+        }
+        # Published last: the lock-free fast path above relies on the lock
+        # and stats already existing once the model is visible
+        _models[model_size] = model
+        logger.info(f"Loaded Whisper {model_size} model in {load_seconds:.2f}s ({resident_bytes / (1024 * 1024):.1f}MB)")
+        return model
+
+
+def transcribe_audio(audio_path: str, model_size: str = WHISPER_MODEL_SIZE,
+                     language: str | None = WHISPER_LANGUAGE) -> list[dict]:
+    """Transcribe audio with the shared model and return Whisper segments.
+
+    Segments are cached by audio content hash, model size and language, so
+    a repeated narration skips ASR entirely.
+    """
+    content_hash = audio_hash(audio_path)
+    segments = get_transcript(content_hash, model_size, language)
+    if segments is not None:
+        logger.info(f"Using cached transcript for audio {content_hash[:12]}")
+        return segments
+
+    model = get_whisper_model(model_size)
+
+    # Whisper installs kv-cache hooks on the model while decoding, so
+    # concurrent transcriptions on the same instance must be serialized
+    with _model_locks[model_size]:
+        logger.info("Transcribing audio...")
+        with track_stage("transcription"):
+            result = model.transcribe(audio_path, verbose=False, language=language)
+        _model_stats[model_size]["transcriptions"] += 1
+
+    segments = result['segments']
+    store_transcript(content_hash, model_size, language, segments)
+    return segments
+
+
+def preload_models(model_sizes: list[str] = WHISPER_PRELOAD_MODELS):
+    """Load the configured model sizes so the first request doesn't pay for it"""
+    for model_size in model_sizes:
+        try:
+            get_whisper_model(model_size)
+        except Exception as e:
+            logger.error(f"Error preloading Whisper {model_size} model: {str(e)}")
+
+
+def get_model_status() -> dict:
+    """Report which models are loaded with their load time and resident size"""
+    with _registry_lock:
+        return {
+            "default_model": WHISPER_MODEL_SIZE,
+            "preload": WHISPER_PRELOAD_MODELS,
+            "loaded": {size: dict(stats) for size, stats in _model_stats.items()}
+        }
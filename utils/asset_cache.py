@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from utils.logging_setup import logger
+from config import ASSET_CACHE_DIR, ASSET_CACHE_MAX_BYTES
+
+# Blobs are stored once per content hash; the index maps each URL to the
+# blob it last resolved to plus the validators needed to revalidate it.
+# Entries are kept in LRU order (least recently used first).
+_INDEX_PATH = os.path.join(ASSET_CACHE_DIR, "index.json")
+_index = OrderedDict()
+_lock = threading.Lock()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "revalidated": 0,
+    "refreshed": 0,
+    "evictions": 0,
+    "bytes_served": 0
+}
+
+
+def _blob_path(content_hash: str, format_ext: str) -> str:
+    return os.path.join(ASSET_CACHE_DIR, f"{content_hash}.{format_ext}")
+
+
+def _link_or_copy(src: str, dst: str):
+    """Hard-link src to dst, falling back to a copy across filesystems"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _save_index():
+    tmp_path = f"{_INDEX_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(list(_index.items()), f)
+    os.replace(tmp_path, _INDEX_PATH)
+
+
+def _load_index():
+    if not os.path.exists(_INDEX_PATH):
+        return
+    try:
+        with open(_INDEX_PATH) as f:
+            for url, entry in json.load(f):
+                if os.path.exists(entry["path"]):
+                    _index[url] = entry
+        logger.info(f"Loaded asset cache index with {len(_index)} entries")
+    except Exception as e:
+        logger.error(f"Error loading asset cache index, starting empty: {str(e)}")
+        _index.clear()
+
+
+def _cached_bytes() -> int:
+    blobs = {entry["path"]: entry["size"] for entry in _index.values()}
+    return sum(blobs.values())
+
+
+def _evict():
+    """Drop least recently used URLs until the referenced blobs fit the budget"""
+    while _index and _cached_bytes() > ASSET_CACHE_MAX_BYTES:
+        url, entry = _index.popitem(last=False)
+        _stats["evictions"] += 1
+        if not any(other["path"] == entry["path"] for other in _index.values()):
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+        logger.info(f"Evicted cached asset: {url}")
+
+
+def get_cached_asset(url: str) -> dict | None:
+    """Return the cache entry for a URL, or None if it isn't cached"""
+    with _lock:
+        entry = _index.get(url)
+        return dict(entry) if entry else None
+
+
+def conditional_headers(entry: dict | None) -> dict:
+    """Build revalidation headers for a cached entry"""
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def use_cached_asset(url: str, file_path: str) -> bool:
+    """Place the cached copy of url at file_path after a 304.
+
+    Returns False if the blob has disappeared, in which case the caller
+    should download the asset again.
+    """
+    with _lock:
+        entry = _index.get(url)
+        if entry is None or not os.path.exists(entry["path"]):
+            _index.pop(url, None)
+            return False
+
+        _link_or_copy(entry["path"], file_path)
+        _index.move_to_end(url)
+        entry["last_used"] = time.time()
+        _stats["hits"] += 1
+        _stats["revalidated"] += 1
+        _stats["bytes_served"] += entry["size"]
+        return True
+
+
+def store_asset(url: str, file_path: str, content_hash: str, format_ext: str,
+                etag: str | None, last_modified: str | None):
+    """Record a freshly downloaded file in the cache"""
+    size = os.path.getsize(file_path)
+    if size > ASSET_CACHE_MAX_BYTES:
+        return
+
+    with _lock:
+        blob_path = _blob_path(content_hash, format_ext)
+        if not os.path.exists(blob_path):
+            _link_or_copy(file_path, blob_path)
+
+        if url in _index:
+            _stats["refreshed"] += 1
+        _stats["misses"] += 1
+
+        _index[url] = {
+            "path": blob_path,
+            "content_hash": content_hash,
+            "format": format_ext,
+            "size": size,
+            "etag": etag,
+            "last_modified": last_modified,
+            "last_used": time.time()
+        }
+        _index.move_to_end(url)
+        _evict()
+
+        try:
+            _save_index()
+        except Exception as e:
+            logger.error(f"Error saving asset cache index: {str(e)}")
+
+
+def get_cache_stats() -> dict:
+    """Report cache usage and hit/miss counters"""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "entries": len(_index),
+            "blobs": len({entry["path"] for entry in _index.values()}),
+            "bytes": _cached_bytes(),
+            "max_bytes": ASSET_CACHE_MAX_BYTES,
+            "hit_ratio": round(_stats["hits"] / lookups, 3) if lookups else None,
+            **_stats
+        }
+
+
+os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+_load_index()
@@ -0,0 +1,46 @@
+import subprocess
+import time
+from contextlib import contextmanager
+from services.metrics import track_ffmpeg
+from services.profiling import current_session, run_profiled, RusagePopen, record_process
+
+
+def run_ffmpeg(step: str, command: list[str], **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run for ffmpeg/ffprobe, timed under the given step name.
+
+    Inside a profiled request the child's wall and CPU time are recorded too.
+    """
+    with track_ffmpeg(step):
+        session = current_session()
+        if session is not None:
+            return run_profiled(session, step, command, **kwargs)
+        return subprocess.run(command, **kwargs)
+
+
+def ffmpeg_output(step: str, command: list[str], **kwargs) -> bytes:
+    """subprocess.check_output for ffmpeg/ffprobe, timed under the given step name"""
+    return run_ffmpeg(step, command, check=True, stdout=subprocess.PIPE, **kwargs).stdout
+
+
+@contextmanager
+def open_ffmpeg(step: str, command: list[str], **kwargs):
+    """Popen ffmpeg for streaming through its pipes, timed under the given step name.
+
+    The process is killed if the block exits before it has finished.
+    """
+    start = time.perf_counter()
+    with track_ffmpeg(step):
+        process = RusagePopen(command, **kwargs)
+        try:
+            yield process
+        finally:
+            for pipe in (process.stdin, process.stdout):
+                if pipe:
+                    try:
+                        pipe.close()
+                    except OSError:
+                        pass
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            record_process(step, process, time.perf_counter() - start)
@@ -1,8 +1,26 @@
 import os
+import hashlib
+import shutil
+import tempfile
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from fastapi import HTTPException
 from utils.logging_setup import logger
-from config import MIME_TO_FORMAT, SUPPORTED_IMAGE_FORMATS, SUPPORTED_AUDIO_FORMATS, MAX_FILE_SIZE_MB
+from services.metrics import track_stage
+from utils.asset_cache import get_cached_asset, conditional_headers, use_cached_asset, store_asset
+from config import (
+    MIME_TO_FORMAT, SUPPORTED_IMAGE_FORMATS, SUPPORTED_AUDIO_FORMATS, MAX_FILE_SIZE_MB,
+    DOWNLOAD_CHUNK_SIZE, DOWNLOAD_TIMEOUT_SECONDS, DOWNLOAD_WORKERS, ASSET_CACHE_ENABLED, TEMP_DIR
+)
+
+# Shared session so concurrent downloads reuse pooled keep-alive connections
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS))
+_session.mount("https://", HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS))
+
+# Dedicated pool so downloads started from render workers never wait on render slots
+_download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="download")
 
 def check_file_size(file_path: str, max_size_mb: int = MAX_FILE_SIZE_MB):
     """Check if file size is within limits"""
@@ -74,24 +92,107 @@ def detect_format(content_type: str, url: str, is_audio: bool = False) -> str:
     else:
         return 'jpg'  # Default image format
 
-def download_file(url: str, is_audio: bool = False) -> tuple[bytes, str]:
-    """Download file from URL and detect its format"""
+@track_stage("download")
+def download_file(url: str, path_prefix: str, is_audio: bool = False, max_size_mb: int = MAX_FILE_SIZE_MB,
+                  use_cache: bool = ASSET_CACHE_ENABLED) -> tuple[str, str]:
+    """Stream file from URL straight to disk, enforcing the size limit as it downloads.
+
+    The detected format is appended to path_prefix as the file extension.
+    Returns the written file path and the detected format. When the asset
+    cache is enabled, previously seen URLs are revalidated with a
+    conditional request and served from the cache if unchanged.
+    """
+    max_bytes = max_size_mb * 1024 * 1024
+    file_path = None
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        content_type = response.headers.get('content-type', '')
-        format_ext = detect_format(content_type, url, is_audio)
-        
-        logger.info(f"Detected format: {format_ext} from content-type: {content_type}")
-        return response.content, format_ext
-    
+        entry = get_cached_asset(url) if use_cache else None
+        with _session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS,
+                          headers=conditional_headers(entry)) as response:
+            if entry and response.status_code == 304:
+                file_path = f"{path_prefix}.{entry['format']}"
+                if use_cached_asset(url, file_path):
+                    logger.info(f"Asset unchanged, using cached copy of {url}")
+                    return file_path, entry['format']
+                # The cached blob vanished underneath us, fetch it again
+                return download_file(url, path_prefix, is_audio, max_size_mb, use_cache=False)
+
+            response.raise_for_status()
+
+            content_type = response.headers.get('content-type', '')
+            format_ext = detect_format(content_type, url, is_audio)
+            logger.info(f"Detected format: {format_ext} from content-type: {content_type}")
+
+            # Reject oversized files before reading the body when the server tells us the size
+            content_length = response.headers.get('content-length')
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File too large: {int(content_length) / (1024 * 1024):.2f}MB (max {max_size_mb}MB)"
+                )
+
+            file_path = f"{path_prefix}.{format_ext}"
+            bytes_written = 0
+            hasher = hashlib.sha256()
+            with open(file_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    bytes_written += len(chunk)
+                    if bytes_written > max_bytes:
+                        raise HTTPException(
+                            status_code=400,
+                            detail=f"File too large: exceeded {max_size_mb}MB while downloading"
+                        )
+                    hasher.update(chunk)
+                    f.write(chunk)
+
+            etag = response.headers.get('etag')
+            last_modified = response.headers.get('last-modified')
+
+        logger.info(f"Downloaded {bytes_written} bytes to {file_path}")
+
+        if use_cache:
+            try:
+                store_asset(url, file_path, hasher.hexdigest(), format_ext, etag, last_modified)
+            except Exception as e:
+                logger.error(f"Error caching {url}: {str(e)}")
+
+        return file_path, format_ext
+
+    except HTTPException:
+        clean_temp_files([file_path] if file_path else [])
+        raise
     except Exception as e:
+        clean_temp_files([file_path] if file_path else [])
         raise HTTPException(
             status_code=500,
             detail=f"Error downloading file from {url}: {str(e)}"
         )
 
+def submit_download(url: str, path_prefix: str, is_audio: bool = False):
+    """Start download_file on the download pool and return its future"""
+    return _download_executor.submit(download_file, url, path_prefix, is_audio)
+
+def download_files(downloads: list[tuple[str, str, bool]]) -> list[tuple[str, str]]:
+    """Download several (url, path_prefix, is_audio) inputs concurrently.
+
+    Results come back in input order. If any download fails, the files that
+    did arrive are removed and the first failure (in input order) is raised.
+    """
+    futures = [submit_download(url, path_prefix, is_audio) for url, path_prefix, is_audio in downloads]
+
+    results = []
+    errors = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            errors.append(e)
+
+    if errors:
+        clean_temp_files([file_path for file_path, _ in results])
+        raise errors[0]
+
+    return results
+
 def clean_temp_files(file_paths: list[str]):
     """Delete temporary files"""
     for file_path in file_paths:
@@ -100,4 +201,20 @@ def clean_temp_files(file_paths: list[str]):
                 os.remove(file_path)
                 logger.info(f"Cleaned up: {file_path}")
         except Exception as e:
-            logger.error(f"Error cleaning up {file_path}: {str(e)}")
\ No newline at end of file
+            logger.error(f"Error cleaning up {file_path}: {str(e)}")
+
+def create_workspace(prefix: str = "request") -> str:
+    """Create a unique scratch directory for one request's files"""
+    workspace = tempfile.mkdtemp(prefix=f"{prefix}_", dir=TEMP_DIR)
+    logger.info(f"Created workspace: {workspace}")
+    return workspace
+
+def remove_workspace(workspace: str):
+    """Delete a request workspace and everything in it"""
+    try:
+        shutil.rmtree(workspace)
+        logger.info(f"Cleaned up workspace: {workspace}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error cleaning up workspace {workspace}: {str(e)}")